@@ -0,0 +1,381 @@
+import os
+import time
+import socket
+import asyncio
+import secrets
+import argparse
+import redis
+import pymongo
+import redis.asyncio as aioredis
+from redis.exceptions import ResponseError
+from pymongo.errors import BulkWriteError
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from model_registry import ClusterModelRegistry
+from redis_features import AsyncDynamicFeatureStore
+from scoring import (parse_transaction, build_feature_vector, profile_update,
+                     categorize, print_result, score_wave)
+
+# ========== Asyncio Consumer Pipeline ==========
+# Same scoring as consumer.py, split into stages connected by bounded queues so
+# Redis reads, feature lookups, model scoring and persistence overlap:
+#
+#   reader ──▶ features ──▶ scoring (thread pool) ──▶ persistence ──▶ XACK
+#
+# A user's next transaction only enters the feature stage once their previous
+# one has been persisted, because a Legit write-back changes the user's profile.
+# Retrained model generations are loaded on their own thread and swapped in
+# between waves.
+
+STREAMS = ["csv_to_producer", "custom_input_stream"]
+FRAUD_TOKEN_KEY = "fraud_token_counter"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Asyncio fraud scoring consumer")
+    parser.add_argument("--group", default="fraud_scorers",
+                        help="Redis consumer group shared by all consumer processes")
+    parser.add_argument("--consumer-name", default=f"{socket.gethostname()}-{os.getpid()}-async",
+                        help="Unique name of this consumer within the group")
+    parser.add_argument("--batch-size", type=int, default=64,
+                        help="Max messages per stream read and per scoring wave")
+    parser.add_argument("--queue-size", type=int, default=8,
+                        help="Max waves buffered between stages")
+    parser.add_argument("--score-workers", type=int, default=2,
+                        help="Waves scored in parallel, each on its own thread")
+    parser.add_argument("--scorer", choices=ClusterModelRegistry.SCORERS, default="numpy",
+                        help="Isolation Forest scorer: compiled NumPy trees or sklearn")
+    parser.add_argument("--no-assign-new-users", action="store_true",
+                        help="Score users missing from the cluster mapping with the fallback model "
+                             "instead of assigning them a cluster online")
+    parser.add_argument("--claim-idle-ms", type=int, default=60000,
+                        help="Reclaim pending messages idle this long (e.g. from a crashed worker)")
+    return parser.parse_args()
+
+class Entry:
+    """One transaction travelling through the pipeline"""
+    __slots__ = ("token", "tx", "done", "feature_vector", "cluster", "prob", "category")
+
+    def __init__(self, token, tx):
+        self.token = token
+        self.tx = tx
+        self.done = asyncio.Event()
+        self.feature_vector = None
+        self.cluster = None
+        self.prob = None
+        self.category = None
+
+class AsyncConsumer:
+    def __init__(self, args):
+        self.args = args
+        self.r = aioredis.Redis(host='localhost', port=6379, decode_responses=True)
+        mongo_client = pymongo.MongoClient("mongodb://localhost:27017/")
+        self.db = mongo_client["RedisTransactions"]
+        self.fraud_collection = self.db["fraud_transactions"]
+        self.legit_collection = self.db["legit_transactions"]
+
+        # Online cluster assignment runs on the scoring threads, so it gets a blocking client
+        self.registry = ClusterModelRegistry("cluster_models", "user_cluster_mapping.json",
+                                             scorer=args.scorer,
+                                             assign_new_users=not args.no_assign_new_users,
+                                             redis_client=redis.Redis(host='localhost', port=6379,
+                                                                      decode_responses=True))
+        self.feature_store = AsyncDynamicFeatureStore(self.r)
+        self.suspicion_buffers = defaultdict(list)
+        self.inflight = {}  # user id → done event of their latest unpersisted transaction
+
+        self.read_queue = asyncio.Queue(maxsize=args.batch_size * args.queue_size)
+        self.score_queue = asyncio.Queue(maxsize=args.queue_size)
+        self.persist_queue = asyncio.Queue(maxsize=args.queue_size)
+        self.score_pool = ThreadPoolExecutor(max_workers=args.score_workers, thread_name_prefix="score")
+        self.mongo_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mongo")
+        self.reload_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reload")
+        self.processed = 0
+        self.last_claim = 0.0
+        self.claim_cursors = {}  # stream → XAUTOCLAIM cursor of the reclaim pass in progress
+
+    # ========== Helpers ==========
+    async def ack(self, tokens):
+        ids_by_stream = defaultdict(list)
+        for stream_name, msg_id in tokens:
+            ids_by_stream[stream_name].append(msg_id)
+        for stream_name, msg_ids in ids_by_stream.items():
+            await self.r.xack(stream_name, self.args.group, *msg_ids)
+
+    def release(self, entry):
+        """Let the user's next transaction proceed"""
+        entry.done.set()
+        user_id = entry.tx["User_ID"]
+        if self.inflight.get(user_id) is entry.done:
+            del self.inflight[user_id]
+
+    async def setup(self):
+        for stream_name in STREAMS:
+            try:
+                await self.r.xgroup_create(stream_name, self.args.group, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+        loop = asyncio.get_running_loop()
+        count = await loop.run_in_executor(self.mongo_pool, self.fraud_collection.estimated_document_count)
+        await self.r.set(FRAUD_TOKEN_KEY, count, nx=True)
+
+    # ========== Stage 1: Stream Reader ==========
+    async def claim_stale_messages(self):
+        """
+        Take over messages left pending by workers that died before acknowledging them,
+        following each stream's XAUTOCLAIM cursor across reads until nothing is left;
+        only then does the next pass wait for --claim-idle-ms.
+        """
+        if not self.claim_cursors:
+            if time.monotonic() - self.last_claim < self.args.claim_idle_ms / 1000:
+                return []
+            self.claim_cursors.update((stream_name, "0-0") for stream_name in STREAMS)
+
+        messages = []
+        for stream_name in list(self.claim_cursors):
+            if len(messages) >= self.args.batch_size:
+                break
+            response = await self.r.xautoclaim(stream_name, self.args.group, self.args.consumer_name,
+                                               min_idle_time=self.args.claim_idle_ms,
+                                               start_id=self.claim_cursors[stream_name],
+                                               count=self.args.batch_size - len(messages))
+            cursor, claimed = response[0], response[1]
+            messages.extend((stream_name, msg_id, msg_data or {}) for msg_id, msg_data in claimed)
+            if cursor == "0-0" or not claimed:
+                del self.claim_cursors[stream_name]
+            else:
+                self.claim_cursors[stream_name] = cursor
+
+        if not self.claim_cursors:
+            self.last_claim = time.monotonic()
+        if messages:
+            print(f"♻️ Reclaimed {len(messages)} stale pending messages")
+        return messages
+
+    async def read_messages(self):
+        messages = await self.claim_stale_messages()
+        if messages:
+            return messages
+
+        response = await self.r.xreadgroup(self.args.group, self.args.consumer_name,
+                                           {s: ">" for s in STREAMS},
+                                           count=self.args.batch_size, block=self.args.claim_idle_ms)
+        return [(stream_name, msg_id, msg_data)
+                for stream_name, entries in (response or []) for msg_id, msg_data in entries]
+
+    async def reader(self):
+        while True:
+            messages = await self.read_messages()
+            malformed = []
+            for stream_name, msg_id, msg_data in messages:
+                tx = parse_transaction(msg_data)
+                if tx is None:
+                    malformed.append((stream_name, msg_id))
+                    continue
+                await self.read_queue.put(Entry((stream_name, msg_id), tx))
+            if malformed:
+                await self.ack(malformed)
+
+    # ========== Stage 2: Dynamic Features ==========
+    async def feature_stage(self):
+        while True:
+            entries = [await self.read_queue.get()]
+            while len(entries) < self.args.batch_size and not self.read_queue.empty():
+                entries.append(self.read_queue.get_nowait())
+
+            # Waves hold each user at most once; a wave waits for its users' earlier transactions
+            wave = []
+            wave_users = set()
+            for entry in entries:
+                if entry.tx["User_ID"] in wave_users:
+                    await self.compute_features(wave)
+                    wave = []
+                    wave_users = set()
+                wave.append(entry)
+                wave_users.add(entry.tx["User_ID"])
+            if wave:
+                await self.compute_features(wave)
+
+    async def compute_features(self, wave):
+        for entry in wave:
+            user_id = entry.tx["User_ID"]
+            previous = self.inflight.get(user_id)
+            if previous is not None:
+                await previous.wait()
+            self.inflight[user_id] = entry.done
+
+        features = await self.feature_store.compute_many([
+            (e.tx["User_ID"], float(e.tx.get("Amount", 0.0)), e.tx.get("Date", ""), e.tx.get("Time", ""))
+            for e in wave
+        ])
+
+        ready = []
+        for entry, tx_features in zip(wave, features):
+            if isinstance(tx_features, Exception):
+                # Left unacknowledged so the message is retried after --claim-idle-ms
+                print(f"❌ Error computing features for {entry.tx['User_ID']}: {tx_features}")
+                self.release(entry)
+                continue
+            entry.feature_vector = build_feature_vector(entry.tx, tx_features)
+            ready.append(entry)
+
+        if ready:
+            await self.score_queue.put(ready)
+
+    # ========== Stage 3: Model Scoring ==========
+    async def score_stage(self):
+        # Up to --score-workers waves score at once. In-flight waves never share a user:
+        # a user's next transaction only gets features once the previous one is persisted
+        slots = asyncio.Semaphore(self.args.score_workers)
+        scoring = set()
+        while True:
+            await slots.acquire()
+            wave = await self.score_queue.get()
+            # Pinned to the generation current at dispatch, so a reload can't swap models mid-wave
+            task = asyncio.create_task(self.score_wave(wave, self.registry.current))
+            scoring.add(task)
+            task.add_done_callback(scoring.discard)
+            task.add_done_callback(lambda _: slots.release())
+            task.add_done_callback(self.log_wave_failure)
+
+    @staticmethod
+    def log_wave_failure(task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"❌ Scoring task failed: {task.exception()!r}")
+
+    async def score_wave(self, wave, generation):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.score_pool, score_wave, generation,
+                                                 [(e.tx, e.feature_vector) for e in wave])
+        except Exception as e:
+            # Left unacknowledged so the messages are retried after --claim-idle-ms
+            print(f"❌ Error scoring batch: {e}")
+            for entry in wave:
+                self.release(entry)
+            return
+
+        # Whatever isn't handed to persistence is released here, even if categorizing or
+        # acking fails, so the users' next transactions don't wait on it forever
+        handed_off = set()
+        try:
+            scored = []
+            unscored = []
+            for entry, result in zip(wave, results):
+                if result is None:
+                    unscored.append(entry.token)
+                    continue
+                cluster, prob, pred, fallback_used = result
+                entry.cluster = cluster
+                entry.category, entry.prob = categorize(self.suspicion_buffers, entry.tx["User_ID"],
+                                                        prob, pred, fallback_used)
+                scored.append(entry)
+
+            if scored:
+                await self.persist_queue.put(scored)
+                handed_off = {id(e) for e in scored}
+            if unscored:
+                await self.ack(unscored)
+        finally:
+            for entry in wave:
+                if id(entry) not in handed_off:
+                    self.release(entry)
+
+    async def model_reloader(self):
+        """Load newly published model generations off the event loop and swap them in"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.registry.check_interval)
+            generation = await loop.run_in_executor(self.reload_pool, self.registry.load_if_changed)
+            if generation is not None:
+                self.registry.swap(generation)
+
+    # ========== Stage 4: Persistence ==========
+    def insert_documents(self, docs_by_collection):
+        """Runs in the Mongo thread; returns ids of documents that failed to insert"""
+        failed = set()
+        for collection, docs in docs_by_collection.items():
+            try:
+                self.db[collection].insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                failed.update(id(docs[err["index"]]) for err in e.details.get("writeErrors", []))
+                print(f"⚠️ {len(e.details.get('writeErrors', []))} inserts into {collection} failed")
+            except Exception as e:
+                failed.update(id(doc) for doc in docs)
+                print(f"❌ Bulk insert into {collection} failed: {e}")
+        return failed
+
+    async def persist_stage(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            wave = await self.persist_queue.get()
+            frauds = [e for e in wave if "FRAUD" in e.category]
+            legits = [e for e in wave if e.category == "🟩 Legit"]
+
+            pipe = self.r.pipeline(transaction=False)
+            for entry in frauds:
+                pipe.incr(FRAUD_TOKEN_KEY)
+            for entry in legits:
+                user_hash_key = f"user:{entry.tx['User_ID']}"
+                pipe.hset(user_hash_key, mapping=profile_update(entry.feature_vector))
+                pipe.hincrby(user_hash_key, "Transaction_Count", 1)
+            try:
+                replies = await pipe.execute()
+            except Exception as e:
+                # Nothing persisted: left unacknowledged so the wave is retried after --claim-idle-ms
+                print(f"❌ Error updating Redis for {len(wave)} scored transactions: {e}")
+                for entry in wave:
+                    self.release(entry)
+                continue
+
+            docs_by_collection = defaultdict(list)
+            for entry in wave:
+                entry.tx.update(entry.feature_vector)
+                entry.tx["fraud_score"] = round(entry.prob, 6)
+            for entry, fraud_token in zip(frauds, replies):
+                entry.tx["fraud_token"] = fraud_token - 1
+                docs_by_collection[self.fraud_collection.name].append(entry.tx)
+            for entry in legits:
+                entry.tx["legit_token"] = secrets.token_hex(8)
+                docs_by_collection[self.legit_collection.name].append(entry.tx)
+
+            failed = set()
+            if docs_by_collection:
+                started = time.perf_counter()
+                failed = await loop.run_in_executor(self.mongo_pool, self.insert_documents, docs_by_collection)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                print(f"💾 Wrote {sum(len(d) for d in docs_by_collection.values())} documents in {elapsed_ms:.2f} ms")
+
+            # Entries whose document failed stay pending and are retried after --claim-idle-ms
+            await self.ack([e.token for e in wave if id(e.tx) not in failed])
+            for entry in wave:
+                print_result(entry.tx["User_ID"], entry.cluster, entry.feature_vector["Amount"],
+                             entry.prob, entry.category)
+                self.release(entry)
+            self.processed += len(wave)
+
+    # ========== Run ==========
+    async def run(self):
+        await self.setup()
+        print(f"👂 Listening on Redis streams {STREAMS} as '{self.args.consumer_name}' "
+              f"in group '{self.args.group}' (asyncio pipeline)")
+        stages = [self.reader(), self.feature_stage(), self.score_stage(), self.persist_stage(),
+                  self.model_reloader()]
+        tasks = [asyncio.create_task(stage) for stage in stages]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.score_pool.shutdown(wait=False)
+            self.reload_pool.shutdown(wait=False)
+            self.mongo_pool.shutdown(wait=True)
+            await self.r.aclose()
+            print(f"📊 Processed {self.processed} transactions")
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(AsyncConsumer(parse_args()).run())
+    except KeyboardInterrupt:
+        # Anything not yet acknowledged stays pending and is reclaimed on the next run
+        print("\n🛑 Exiting gracefully...")
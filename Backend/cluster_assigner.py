@@ -0,0 +1,73 @@
+import time
+import numpy as np
+import hdbscan
+
+# ========== Online Cluster Assignment ==========
+# trigger.py persists the UMAP reducer and HDBSCAN clusterer of each full
+# clustering run. Consumers use them to place users the cluster mapping does
+# not know yet into an existing cluster, instead of scoring them with the
+# fallback model until the next full retrain. The reducer carries its training
+# data and graph, so trigger.py only publishes assigners fitted on a bounded
+# sample (--clustering sampled, or at most --sample-size users).
+
+WARM_UP_ROWS = 16
+
+class ClusterAssigner:
+    """
+    Places new feature rows into the clusters of a fitted UMAP + HDBSCAN run.
+
+    Rows are projected with the reducer's transform() and then labelled with
+    hdbscan.approximate_predict. If HDBSCAN's prediction data cannot be built
+    (UMAP leaves disconnected training points at NaN), rows go to the nearest
+    cluster centroid in embedding space, or -1 (noise) if they fall outside
+    that cluster's radius.
+    """
+
+    def __init__(self, reducer, clusterer, feature_matrix, embedding, labels):
+        self.reducer = reducer
+        self.clusterer = clusterer
+        self.fitted_rows = len(feature_matrix)  # the pickled reducer keeps all of them
+        self.sample = np.asarray(feature_matrix[:WARM_UP_ROWS], dtype=np.float64)
+
+        try:
+            clusterer.generate_prediction_data()
+            self.method = "approximate_predict"
+        except Exception as e:
+            print(f"⚠️ HDBSCAN prediction data unavailable, assigning by nearest centroid: {e}")
+            self.method = "centroid"
+
+        # Centroids and radii of each cluster over the finite part of the embedding
+        labels = np.asarray(labels)
+        finite = np.isfinite(embedding).all(axis=1)
+        self.cluster_ids = np.array(sorted(set(labels[finite].tolist()) - {-1}), dtype=int)
+        self.centroids = np.empty((len(self.cluster_ids), embedding.shape[1]))
+        self.radii = np.empty(len(self.cluster_ids))
+        for i, cluster_id in enumerate(self.cluster_ids):
+            members = embedding[finite & (labels == cluster_id)]
+            self.centroids[i] = members.mean(axis=0)
+            self.radii[i] = np.linalg.norm(members - self.centroids[i], axis=1).max()
+
+    def nearest_centroid(self, embedding):
+        labels = np.full(len(embedding), -1, dtype=int)
+        if not len(self.cluster_ids):
+            return labels
+        distances = np.linalg.norm(embedding[:, None, :] - self.centroids[None, :, :], axis=2)
+        nearest = np.argmin(np.nan_to_num(distances, nan=np.inf), axis=1)
+        inside = distances[np.arange(len(embedding)), nearest] <= self.radii[nearest]
+        labels[inside] = self.cluster_ids[nearest[inside]]
+        return labels
+
+    def assign(self, X):
+        """Return a cluster id (-1 = noise) for each feature row of X"""
+        embedding = self.reducer.transform(np.array(X, dtype=np.float64, ndmin=2))
+        if self.method == "approximate_predict":
+            labels, _ = hdbscan.approximate_predict(self.clusterer, embedding)
+            return np.asarray(labels, dtype=int)
+        return self.nearest_centroid(embedding)
+
+    def warm_up(self):
+        """Run single rows and a small batch through once so numba compiles before traffic arrives"""
+        started = time.perf_counter()
+        for n_rows in (1, len(self.sample)):
+            self.assign(self.sample[:n_rows])
+        return time.perf_counter() - started
@@ -0,0 +1,77 @@
+import os
+import numpy as np
+
+# ========== Compact User → Cluster Index ==========
+# One file holding two .npy arrays back to back: the user ids, sorted, as
+# fixed-width utf-8 bytes, then each user's cluster as int16. Both are
+# memory-mapped read-only, so opening takes the same time for any number of
+# users and forked consumer workers share the same page-cache pages instead of
+# each holding a dict of dicts.
+
+HEADER_READERS = {
+    (1, 0): np.lib.format.read_array_header_1_0,
+    (2, 0): np.lib.format.read_array_header_2_0
+}
+
+def write_cluster_index(path, cluster_map):
+    """Write {user_id: {"Cluster": c}} as an index file, atomically"""
+    ids = np.char.encode(np.asarray(list(cluster_map), dtype=str), "utf-8")
+    clusters = np.fromiter((meta["Cluster"] for meta in cluster_map.values()), dtype=np.int64, count=len(ids))
+    if len(clusters) and (clusters.min() < np.iinfo(np.int16).min or clusters.max() > np.iinfo(np.int16).max):
+        raise ValueError("Cluster ids do not fit in int16")
+
+    order = np.argsort(ids, kind='stable')
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, ids[order])
+        np.save(f, clusters[order].astype(np.int16))
+    os.replace(tmp_path, path)
+
+def _map_next_array(f, path):
+    version = np.lib.format.read_magic(f)
+    shape, _, dtype = HEADER_READERS[version](f)
+    offset = f.tell()
+    f.seek(offset + int(np.prod(shape)) * dtype.itemsize)
+    if not np.prod(shape):
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+class UserClusterIndex:
+    """
+    Read-only user → cluster lookups over a write_cluster_index() file.
+
+    get() mirrors the JSON mapping ({"Cluster": c} or None), so the index
+    drops in wherever the dict loaded from user_cluster_mapping.json was used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.user_ids = _map_next_array(f, path)
+            self.clusters = _map_next_array(f, path)
+        self.id_width = self.user_ids.dtype.itemsize
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def cluster(self, user_id, default=None):
+        key = str(user_id).encode("utf-8")
+        if len(key) > self.id_width or not len(self.user_ids):
+            return default
+        position = np.searchsorted(self.user_ids, key)
+        if position < len(self.user_ids) and self.user_ids[position] == key:
+            return int(self.clusters[position])
+        return default
+
+    def get(self, user_id, default=None):
+        cluster = self.cluster(user_id)
+        return default if cluster is None else {"Cluster": cluster}
+
+    def __contains__(self, user_id):
+        return self.cluster(user_id) is not None
+
+    def __getitem__(self, user_id):
+        cluster_info = self.get(user_id)
+        if cluster_info is None:
+            raise KeyError(user_id)
+        return cluster_info
@@ -1,312 +1,324 @@
 import redis
-import ast
 import time
-import joblib
 import os
-import numpy as np
+import sys
+import subprocess
 import pymongo
 import secrets
-from datetime import datetime, timedelta
-from trigger import generate_user_cluster_hashmap
+import socket
+import argparse
+from model_registry import ClusterModelRegistry
+from redis_features import DynamicFeatureStore
+from scoring import (parse_transaction, build_feature_vector, profile_update,
+                     categorize, print_result, score_wave)
+from mongo_writer import BulkMongoWriter
 from sklearn.preprocessing import StandardScaler
 from collections import defaultdict
 
+# ========== Startup Options ==========
+parser = argparse.ArgumentParser(description="Real-time fraud scoring consumer")
+parser.add_argument("--retrain", action="store_true",
+                    help="Recluster and retrain all models before consuming (slow cold start)")
+parser.add_argument("--wait-for-models", action="store_true",
+                    help="With no cluster mapping yet, wait for one to be published instead of "
+                         "running a full clustering (launcher.py workers)")
+parser.add_argument("--batch-size", type=int, default=1,
+                    help="Read and score up to N messages per batch (1 = message at a time)")
+parser.add_argument("--batch-wait-ms", type=int, default=50,
+                    help="Max time to wait for a batch to fill once its first message arrives")
+parser.add_argument("--group", default="fraud_scorers",
+                    help="Redis consumer group shared by all consumer processes")
+parser.add_argument("--consumer-name", default=f"{socket.gethostname()}-{os.getpid()}",
+                    help="Unique name of this consumer within the group")
+parser.add_argument("--claim-idle-ms", type=int, default=60000,
+                    help="Reclaim pending messages idle this long (e.g. from a crashed worker)")
+parser.add_argument("--scorer", choices=ClusterModelRegistry.SCORERS, default="numpy",
+                    help="Isolation Forest scorer: compiled NumPy trees or sklearn")
+parser.add_argument("--no-assign-new-users", action="store_true",
+                    help="Score users missing from the cluster mapping with the fallback model "
+                         "instead of assigning them a cluster online")
+parser.add_argument("--mongo-batch-size", type=int, default=500,
+                    help="Max documents per MongoDB insert_many")
+parser.add_argument("--mongo-flush-ms", type=int, default=200,
+                    help="Max time a document waits in the MongoDB write buffer")
+parser.add_argument("--mongo-queue-size", type=int, default=10000,
+                    help="Buffered documents before scoring blocks on MongoDB (backpressure)")
+args = parser.parse_args()
+
 # ========== MongoDB Setup ==========
 mongo_client = pymongo.MongoClient("mongodb://localhost:27017/")
 db = mongo_client["RedisTransactions"]
 fraud_collection = db["fraud_transactions"]
 legit_collection = db["legit_transactions"]
-fraud_counter = fraud_collection.estimated_document_count()
 
 # ========== Redis Setup ==========
 r = redis.Redis(host='localhost', port=6379, decode_responses=True)
-last_ids = {
-    "csv_to_producer": '0-0',
-    "custom_input_stream": '0-0'
-}
-
-# ========== Merchant & Device Encoding ==========
-MERCHANT_MAP = {
-    'Luxury Goods': 0,
-    'Travel': 1,
-    'Electronics': 2,
-    'Apparel': 3,
-    'Food Delivery': 4,
-    'Online Services': 5,
-    'Groceries': 6,
-    'Utilities': 7,
-    'Medical': 8,
-    'Wellness': 9,
-    'Organic Grocery': 10,
-    'Jewelry': 11,
-    'Health': 12,
-    'Hygiene Products': 13,
-    'Apparel (gifts)': 14,
-    'Food': 15,
-    'Apparel Deals': 16
-}
-DEVICE_MAP = {'Mobile': 0, 'PC': 1, 'Tablet': 2}
+STREAMS = ["csv_to_producer", "custom_input_stream"]
+
+# Every worker in the group shares one position per stream; a group is created
+# once from the start of each stream and later restarts resume where it left off
+for stream_name in STREAMS:
+    try:
+        r.xgroup_create(stream_name, args.group, id="0", mkstream=True)
+    except redis.exceptions.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+def ack_messages(tokens):
+    ids_by_stream = defaultdict(list)
+    for stream_name, msg_id in tokens:
+        ids_by_stream[stream_name].append(msg_id)
+    for stream_name, msg_ids in ids_by_stream.items():
+        r.xack(stream_name, args.group, *msg_ids)
+
+# Scored transactions are persisted by a background bulk writer; a stream entry
+# that produced a document is only acknowledged once that document is written
+mongo_writer = BulkMongoWriter(db, batch_size=args.mongo_batch_size,
+                               flush_interval=args.mongo_flush_ms / 1000,
+                               max_queue=args.mongo_queue_size,
+                               on_flushed=ack_messages)
+
+# Fraud tokens come from a Redis counter so concurrent workers never reuse one
+FRAUD_TOKEN_KEY = "fraud_token_counter"
+r.set(FRAUD_TOKEN_KEY, fraud_collection.estimated_document_count(), nx=True)
 
 # ========== Trigger & Cluster Load ==========
-print("🔁 Triggering cluster re-training...")
-user_cluster_map = generate_user_cluster_hashmap()
-print(f"✅ Cluster mapping loaded for {len(user_cluster_map)} users.")
-
-# ========== Fallback Model ==========
-try:
-    fallback_model = joblib.load("cluster_models/fallback_xgboost_model.joblib")
-    fallback_scaler = joblib.load("cluster_models/fallback_scaler.joblib")  # assuming you saved a scaler too
-    print("✅ Loaded fallback XGBoost model and scaler")
-except FileNotFoundError:
-    print("❌ Fallback model or scaler not found.")
-    fallback_model = None
+# Retraining normally runs as its own job (`python trigger.py [--interval N]`); by
+# default the consumer fast-starts from the persisted mapping and model bundles.
+# When it does retrain, trigger.py runs as a child process rather than being
+# imported: its worker pools use spawn, which re-executes the main script, and
+# this script has no __main__ guard.
+def run_trigger():
+    trigger_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "trigger.py")
+    subprocess.run([sys.executable, trigger_script], check=True)
+
+if args.retrain:
+    print("🔁 Triggering cluster re-training...")
+    run_trigger()
+
+# ========== Resident Models ==========
+# Cluster bundles, the fallback model and the cluster mapping are loaded once here
+# instead of per message, and hot-swapped when trigger.py publishes a new generation
+startup = time.perf_counter()
+registry = ClusterModelRegistry("cluster_models", "user_cluster_mapping.json", scorer=args.scorer,
+                                assign_new_users=not args.no_assign_new_users, redis_client=r)
+if not registry.user_cluster_map and args.wait_for_models:
+    # launcher.py runs the bootstrap once; its workers never start trigger.py themselves
+    print("⏳ No cluster mapping yet, waiting for a model generation to be published...")
+    while not registry.user_cluster_map:
+        time.sleep(registry.check_interval)
+        registry.reload_if_changed()
+elif not registry.user_cluster_map:
+    print("⚠️ No existing cluster mapping found, running full clustering...")
+    run_trigger()  # no persisted mapping yet: bootstraps a full clustering run
+    registry.reload_if_changed(force=True)
+print(f"✅ Cluster mapping loaded for {len(registry.user_cluster_map)} users "
+      f"in {(time.perf_counter() - startup) * 1000:.0f} ms.")
 
 # ========== Suspicion Buffers ==========
 suspicion_buffers = defaultdict(list)
 
 # ========== Dynamic Feature Extraction ==========
-def compute_dynamic_features(user_id, amount, date_str, time_str):
-    hash_key = f"user:{user_id}"
-    today = date_str
-    timestamp = f"{date_str} {time_str}"
-    dt = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
-
-    avg_amt = float(r.hget(hash_key, "Avg_Amount") or 0)
-    last_large_date = r.hget(hash_key, "Last_Large_Date")
-    today_count = int(r.hget(f"{hash_key}:tx:{today}", "count") or 0)
-
-    avg_amt = round((avg_amt + amount) / 2, 2) if avg_amt > 0 else amount
-    r.hincrby(f"{hash_key}:tx:{today}", "count", 1)
-
-    yesterday = (dt - timedelta(days=1)).strftime("%Y-%m-%d")
-    y_count = int(r.hget(f"{hash_key}:tx:{yesterday}", "count") or 0)
-    tx_per_day = round((today_count + y_count) / 2, 2)
-
-    month_key = dt.strftime("%Y-%m")
-    r.hincrby(f"{hash_key}:velocity:{month_key}", "count", 1)
-    velocity_data = r.hgetall(f"{hash_key}:velocity:{month_key}")
-    monthly_counts = [int(v) for v in velocity_data.values()] if velocity_data else [1]
-    velocity = round(np.mean(monthly_counts), 2) if monthly_counts else 1.0
-
-    large_txn_flag = 1 if amount > 1.5 * avg_amt else 0
-    if large_txn_flag:
-        if last_large_date:
-            last = datetime.strptime(last_large_date, "%Y-%m-%d")
-            days_between = (dt - last).days
-        else:
-            days_between = 30
-        r.hset(hash_key, "Last_Large_Date", date_str)
-    else:
-        days_between = float(r.hget(hash_key, "Large_Transaction_Frequency") or 30.0)
-
-    ltf = round((days_between + float(r.hget(hash_key, "Large_Transaction_Frequency") or 30.0)) / 2, 2)
-
-    return {
-        "Avg_Amount": avg_amt,
-        "Transactions_Per_Day": tx_per_day,
-        "Velocity": velocity,
-        "Large_Transaction_Flag": large_txn_flag,
-        "Large_Transaction_Frequency": ltf
-    }
+# One atomic Lua call per transaction, pipelined across a wave of transactions
+feature_store = DynamicFeatureStore(r)
+
+def persist(tx, feature_vector, category, prob, token=None):
+    """Queue the scored transaction for MongoDB. Returns True if a document was queued."""
+    user_id = tx["User_ID"]
+    tx.update(feature_vector)
+    tx["fraud_score"] = round(prob, 6)
+
+    if "FRAUD" in category:
+        tx["fraud_token"] = r.incr(FRAUD_TOKEN_KEY) - 1
+        mongo_writer.submit(fraud_collection.name, tx, token)
+        return True
+    elif category == "🟩 Legit":
+        tx["legit_token"] = secrets.token_hex(8)
+        mongo_writer.submit(legit_collection.name, tx, token)
+        user_hash_key = f"user:{user_id}"
+        r.hset(user_hash_key, mapping=profile_update(feature_vector))
+        r.hincrby(user_hash_key, "Transaction_Count", 1)
+        return True
+    return False
+
+# ========== Batch Scoring ==========
+last_claim = 0.0
+claim_cursors = {}  # stream → XAUTOCLAIM cursor of the reclaim pass in progress
+
+def claim_stale_messages():
+    """
+    Take over messages left pending by workers that died before acknowledging them.
+    A reclaim pass follows each stream's XAUTOCLAIM cursor across calls, one batch
+    at a time, until nothing is left to claim; only then does the next pass wait
+    for --claim-idle-ms.
+    """
+    global last_claim
+    if not claim_cursors:
+        if time.monotonic() - last_claim < args.claim_idle_ms / 1000:
+            return []
+        claim_cursors.update((stream_name, "0-0") for stream_name in STREAMS)
+
+    batch = []
+    for stream_name in list(claim_cursors):
+        while len(batch) < args.batch_size:
+            response = r.xautoclaim(stream_name, args.group, args.consumer_name,
+                                    min_idle_time=args.claim_idle_ms, start_id=claim_cursors[stream_name],
+                                    count=args.batch_size - len(batch))
+            cursor, messages = response[0], response[1]
+            for msg_id, msg_data in messages:
+                batch.append((stream_name, msg_id, msg_data or {}))
+            if cursor == "0-0" or not messages:
+                del claim_cursors[stream_name]
+                break
+            claim_cursors[stream_name] = cursor
+        if len(batch) >= args.batch_size:
+            break
+
+    if not claim_cursors:
+        last_claim = time.monotonic()
+    if batch:
+        print(f"♻️ Reclaimed {len(batch)} stale pending messages")
+    return batch
+
+def read_batch():
+    """
+    Read up to --batch-size messages for this consumer. Blocks until the first
+    message arrives, then waits at most --batch-wait-ms for the batch to fill.
+    """
+    batch = claim_stale_messages()
+    if batch:
+        return batch
+
+    # Wake up periodically while idle so stale pending messages still get reclaimed
+    block = args.claim_idle_ms
+    deadline = None
+    while len(batch) < args.batch_size:
+        response = r.xreadgroup(args.group, args.consumer_name, {s: ">" for s in STREAMS},
+                                count=args.batch_size - len(batch), block=block)
+        if not response:
+            break
+        for stream_name, messages in response:
+            for msg_id, msg_data in messages:
+                batch.append((stream_name, msg_id, msg_data))
+
+        if deadline is None:
+            deadline = time.monotonic() + args.batch_wait_ms / 1000
+        block = int((deadline - time.monotonic()) * 1000)
+        if block <= 0:
+            break
+    return batch
+
+def process_wave(entries):
+    """
+    Score (token, tx) entries of distinct users. Returns (tokens handed to the Mongo
+    writer, tokens that failed and must stay pending for reclaim).
+    """
+    features = feature_store.compute_many([
+        (tx["User_ID"], float(tx.get("Amount", 0.0)), tx.get("Date", ""), tx.get("Time", ""))
+        for _, tx in entries
+    ])
+
+    tokens = []
+    wave = []
+    failed = []
+    for (token, tx), tx_features in zip(entries, features):
+        if isinstance(tx_features, Exception):
+            print(f"❌ Error computing features for {tx['User_ID']}: {tx_features}")
+            failed.append(token)
+            continue
+        tokens.append(token)
+        wave.append((tx, build_feature_vector(tx, tx_features)))
+
+    try:
+        results = score_wave(registry, wave)
+    except Exception as e:
+        print(f"❌ Error scoring batch: {e}")
+        import traceback
+        traceback.print_exc()
+        return [], failed + tokens
+
+    deferred = []
+    for token, (tx, feature_vector), result in zip(tokens, wave, results):
+        if result is None:
+            continue
+        try:
+            user_id = tx["User_ID"]
+            cluster, prob, pred, fallback_used = result
+            category, prob = categorize(suspicion_buffers, user_id, prob, pred, fallback_used)
+            if persist(tx, feature_vector, category, prob, token):
+                deferred.append(token)
+
+            print_result(user_id, cluster, feature_vector['Amount'], prob, category)
+
+        except Exception as e:
+            print(f"❌ Error processing message: {e}")
+            import traceback
+            traceback.print_exc()
+            if token not in deferred:
+                failed.append(token)
+    return deferred, failed
+
+def process_batch(batch):
+    """
+    Process a batch; returns (tokens whose acknowledgement waits on the Mongo writer,
+    tokens that failed and are left pending so XAUTOCLAIM retries them)
+    """
+    # A user's Legit write-back must land before their next transaction's features
+    # are read, so the batch is cut into waves in which each user appears at most once
+    deferred = set()
+    failed = set()
+    wave = []
+    wave_users = set()
+    for stream_name, msg_id, msg_data in batch:
+        print(f"\n🔍 Processing message from {stream_name}: {msg_id}")
+        print(f"🔍 msg_data: {msg_data}")
+        try:
+            tx = parse_transaction(msg_data)
+            if tx is None:
+                continue
+
+            user_id = tx["User_ID"]
+            if user_id in wave_users:
+                wave_deferred, wave_failed = process_wave(wave)
+                deferred.update(wave_deferred)
+                failed.update(wave_failed)
+                wave = []
+                wave_users = set()
+
+            wave.append(((stream_name, msg_id), tx))
+            wave_users.add(user_id)
+
+        except Exception as e:
+            print(f"❌ Error processing message: {e}")
+            import traceback
+            traceback.print_exc()
+
+    if wave:
+        wave_deferred, wave_failed = process_wave(wave)
+        deferred.update(wave_deferred)
+        failed.update(wave_failed)
+    return deferred, failed
 
 # ========== Main Listener ==========
-print(f"👂 Listening on Redis streams: {list(last_ids.keys())}")
+print(f"👂 Listening on Redis streams {STREAMS} as '{args.consumer_name}' in group '{args.group}'")
 
 while True:
     try:
-        response = r.xread(streams=last_ids, block=0, count=1)
-        if response:
-            for stream_name, messages in response:
-                for msg_id, msg_data in messages:
-                    last_ids[stream_name] = msg_id  # ✅ Move to next message
-
-                    print(f"\n🔍 Processing message from {stream_name}: {msg_id}")
-                    print(f"🔍 msg_data: {msg_data}")
-                    try:
-                        if "data" not in msg_data:
-                            print("⚠️ Skipping malformed message (no 'data' key)")
-                            continue
-
-                        data_str = msg_data["data"]
-                        if data_str.startswith("'") and data_str.endswith("'"):
-                            data_str = data_str[1:-1]
-
-                        tx = ast.literal_eval(data_str)
-                        if not isinstance(tx, dict):
-                            print(f"❌ Parsed transaction is not a dictionary")
-                            continue
-
-                        user_id = tx.get("User_ID")
-                        if not user_id:
-                            print("⚠️ Missing User_ID, skipping")
-                            continue
-
-                        amount = float(tx.get("Amount", 0.0))
-                        session_time = float(tx.get("Session_Time", 0.0))
-                        active_loans = int(tx.get("Active_Loans", 0))
-                        merchant = tx.get("Merchant_Category", "")
-                        device = tx.get("Device_Type", "")
-                        date_str = tx.get("Date", "")
-                        time_str = tx.get("Time", "")
-
-                        merchant_code = MERCHANT_MAP.get(merchant, 0)
-                        device_code = DEVICE_MAP.get(device, 0)
-
-                        features = compute_dynamic_features(user_id, amount, date_str, time_str)
-
-                        feature_vector = {
-                            "Amount": amount,
-                            "Avg_Amount": features["Avg_Amount"],
-                            "Active_Loan_Count": active_loans,
-                            "Session_Time": session_time,
-                            "Transactions_Per_Day": features["Transactions_Per_Day"],
-                            "Velocity": features["Velocity"],
-                            "Large_Transaction_Flag": features["Large_Transaction_Flag"],
-                            "Large_Transaction_Frequency": features["Large_Transaction_Frequency"],
-                            "Merchant_Type_Code": merchant_code,
-                            "Device_Type_Code": device_code
-                        }
-
-                        cluster_info = user_cluster_map.get(user_id)
-                        cluster = cluster_info["Cluster"] if cluster_info else None
-                        if cluster == -1:
-                            cluster = None  # treat as unassigned → fallback
-                        X = np.array([feature_vector[k] for k in feature_vector]).reshape(1, -1)
-
-                        # ------------------ Model Prediction ------------------
-                        fallback_used = False
-                        if cluster is not None:
-                            try:
-                                model_bundle = joblib.load(f"cluster_models/cluster_{cluster}_bundle.pkl")
-                                model, scaler, score_min, score_max = model_bundle
-                                X_scaled = scaler.transform(X)
-
-                                score = model.decision_function(X_scaled)[0]
-
-                                # Normalize using actual training score range
-                                if score_max != score_min:
-                                    prob = (score - score_min) / (score_max - score_min)
-                                else:
-                                    prob = 0.5  # fallback if all training scores were same
-
-                            except FileNotFoundError:
-                                if fallback_model and fallback_scaler:
-                                    fallback_used = True
-                                    cluster = "Fallback"
-
-                                    fallback_vector = np.array([[
-                                        amount,
-                                        active_loans,
-                                        session_time,
-                                        feature_vector["Transactions_Per_Day"],        # → Transactions_Per_Unit_Time
-                                        feature_vector["Velocity"],
-                                        feature_vector["Large_Transaction_Flag"],      # → High_Value_Transaction
-                                        feature_vector["Large_Transaction_Frequency"], # → Large_Transaction_Freq
-                                        merchant_code,                                 # → Payment_Method
-                                        device_code                                    # → Device_Type
-                                    ]])
-
-                                    X_scaled = fallback_scaler.transform(fallback_vector)
-                                    pred = fallback_model.predict(X_scaled)[0]
-                                    prob = 1.0 if pred == 1 else 0.0
-                                else:
-                                    print("⚠️ No model or fallback available.")
-                                    pred = None
-                                    prob = None
-
-                        elif fallback_model and fallback_scaler:
-                            fallback_used = True
-                            cluster = "Fallback"
-
-                            # Fallback prediction logic
-                            payment_method = tx.get("Payment_Method", "Credit Card")
-                            PAYMENT_METHOD_MAP = {'Credit Card': 0, 'Debit Card': 1, 'UPI': 2, 'Net Banking': 3, 'Wallet': 4}
-                            payment_method_code = PAYMENT_METHOD_MAP.get(payment_method, 0)
-
-                            transactions_per_unit_time = feature_vector["Transactions_Per_Day"]
-                            high_value_transaction = feature_vector["Large_Transaction_Flag"]
-                            large_transaction_freq = feature_vector["Large_Transaction_Frequency"]
-
-                            fallback_vector = np.array([[
-                                amount,
-                                active_loans,
-                                session_time,
-                                transactions_per_unit_time,
-                                feature_vector["Velocity"],
-                                high_value_transaction,
-                                large_transaction_freq,
-                                payment_method_code,
-                                device_code
-                            ]])
-
-                            X_scaled = fallback_scaler.transform(fallback_vector)
-                            pred = fallback_model.predict(X_scaled)[0]
-                            prob = 1.0 if pred == 1 else 0.0
-
-                        else:
-                            print("⚠️ No cluster or fallback model available.")
-                            pred = None
-                            prob = None
-
-                        # ------------------ Categorization ------------------
-                        if fallback_used:
-                            if pred == 0:
-                                category = "🟩 Legit"
-                                suspicion_buffers[user_id].clear()
-                            else:
-                                category = "🟥 FRAUD"
-                                suspicion_buffers[user_id].clear()
-                            prob = 1.0 if pred == 1 else 0.0
-                        else:
-                            if prob <= 0.4:
-                                category = "🟩 Legit"
-                                suspicion_buffers[user_id].clear()
-                            elif prob <= 0.8:
-                                suspicion_buffers[user_id].append(prob)
-                                buffer_total = sum(suspicion_buffers[user_id])
-                                if buffer_total > 0.8:
-                                    category = "🟥 FRAUD (Buffered)"
-                                    suspicion_buffers[user_id].clear()
-                                else:
-                                    category = "🟨 Suspicious"
-                            else:
-                                category = "🟥 FRAUD"
-                                suspicion_buffers[user_id].clear()
-
-                        # ------------------ Logging and Persistence ------------------
-                        tx.update(feature_vector)
-                        tx["fraud_score"] = round(prob, 6)
-
-                        if "FRAUD" in category:
-                            tx["fraud_token"] = fraud_counter
-                            fraud_collection.insert_one(tx)
-                            fraud_counter += 1
-                        elif category == "🟩 Legit":
-                            tx["legit_token"] = secrets.token_hex(8)
-                            legit_collection.insert_one(tx)
-                            user_hash_key = f"user:{user_id}"
-                            r.hset(user_hash_key, mapping={
-                                "Avg_Amount": feature_vector["Avg_Amount"],
-                                "Active_Loan_Count": feature_vector["Active_Loan_Count"],
-                                "Transactions_Per_Day": feature_vector["Transactions_Per_Day"],
-                                "Velocity": feature_vector["Velocity"],
-                                "Large_Transaction_Frequency": feature_vector["Large_Transaction_Frequency"],
-                                "Large_Transaction_Flag": feature_vector["Large_Transaction_Flag"]
-                            })
-                            r.hincrby(user_hash_key, "Transaction_Count", 1)
-
-                        print(f"\n🚨 Transaction:")
-                        print(f"   User ID         : {user_id}")
-                        print(f"   Cluster         : {cluster}")
-                        print(f"   Amount          : ₹{amount}")
-                        print(f"   Fraud Score     : {prob:.4f}")
-                        print(f"   Category        : {category}")
-
-                    except Exception as e:
-                        print(f"❌ Error processing message: {e}")
-                        import traceback
-                        traceback.print_exc()
+        batch = read_batch()
+        registry.reload_if_changed()  # swap in retrained models between batches
+        if batch:
+            started = time.perf_counter()
+            deferred, failed = process_batch(batch)
+            # Entries with a queued document are acked by the writer once it is written;
+            # failed entries are left unacknowledged and stay pending for reclaim
+            ack_messages([(s, m) for s, m, _ in batch if (s, m) not in deferred and (s, m) not in failed])
+            if len(batch) > 1:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                print(f"⚡ Processed batch of {len(batch)} in {elapsed_ms:.2f} ms")
 
     except KeyboardInterrupt:
         print("\n🛑 Exiting gracefully...")
-        break
\ No newline at end of file
+        break
+
+mongo_writer.close()  # flush buffered documents before exiting
+print(f"💾 MongoDB writer stats: {mongo_writer.stats()}")
@@ -10,6 +10,8 @@ import smtplib
 from email.mime.text import MIMEText
 import secrets
 from streamlit_js_eval import streamlit_js_eval
+from wire_format import encode_transaction
+from redis_features import USER_SET_KEY
 
 # -------------------------------
 # Email Configuration
@@ -616,6 +618,7 @@ def render_2fa_verification(txn_data):
                     "Large_Transaction_Flag": 0
                 })
                 r.hincrby(user_hash_key, "Transaction_Count", 1)
+                r.sadd(USER_SET_KEY, st.session_state.user_id)
                 
                 st.success("✓ Transaction verified and processed successfully")
                 st.session_state.verification_code = None
@@ -691,7 +694,7 @@ def render_transaction():
             }
             
             # Send to Redis stream
-            r.xadd(stream_name, {"data": str(data)})
+            r.xadd(stream_name, encode_transaction(data))
             
             st.success("✓ Transaction submitted for processing")
             
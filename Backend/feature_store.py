@@ -0,0 +1,215 @@
+import os
+import json
+import numpy as np
+
+# ========== Columnar User Feature Store ==========
+# One directory holding every user's aggregated features as a float32 matrix:
+#
+#   meta.json          columns, committed row count, user id width, file version
+#   features.f32       rows x columns float32, row-major, in insertion order
+#   user_ids.{v}.bin   fixed-width utf-8 user ids, one per row
+#   index_ids.{v}.npy  user ids sorted, for binary-search lookups
+#   index_rows.{v}.npy row of each sorted id
+#
+# Everything is memory-mapped, so opening the store is O(1), lookups touch a few
+# pages and updates only rewrite the rows (and appended tail) that changed.
+# An append writes the ids and index under the next version and then replaces
+# meta.json, which is the only commit: an interrupted append leaves meta.json
+# pointing at the previous version's files and row count, so the store reads as
+# it was. Files of older versions are deleted after the commit.
+
+META_FILE = "meta.json"
+FEATURES_FILE = "features.f32"
+IDS_FILE = "user_ids.bin"
+INDEX_IDS_FILE = "index_ids.npy"
+INDEX_ROWS_FILE = "index_rows.npy"
+VERSIONED_FILES = (IDS_FILE, INDEX_IDS_FILE, INDEX_ROWS_FILE)
+VERSIONED_PREFIXES = tuple(os.path.splitext(name)[0] + "." for name in VERSIONED_FILES)
+
+def _encode_ids(user_ids):
+    return np.char.encode(np.asarray(user_ids, dtype=str), "utf-8")
+
+def _versioned(name, version):
+    """user_ids.bin → user_ids.3.bin (version None: the unversioned names of older stores)"""
+    if version is None:
+        return name
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{version}{ext}"
+
+class UserFeatureStore:
+    """Memory-mapped user → feature row store with vectorized lookups and upserts"""
+
+    def __init__(self, path, columns=None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta = self._read_meta() or {"columns": list(columns or []), "rows": 0, "id_width": 1, "version": 0}
+        self.columns = meta["columns"]
+        self.rows = meta["rows"]
+        self.id_width = meta["id_width"]
+        self.version = meta.get("version")
+        self.column_index = {c: i for i, c in enumerate(self.columns)}
+        self._open()
+
+    def __len__(self):
+        return self.rows
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _versioned_file(self, name, version=None):
+        return self._file(_versioned(name, self.version if version is None else version))
+
+    # ========== Files ==========
+    def _read_meta(self):
+        try:
+            with open(self._file(META_FILE), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_meta(self):
+        tmp_path = self._file(f"{META_FILE}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({"columns": self.columns, "rows": self.rows, "id_width": self.id_width,
+                       "version": self.version}, f, indent=4)
+        os.replace(tmp_path, self._file(META_FILE))
+
+    def _open(self):
+        if not self.rows:
+            self.features = np.empty((0, len(self.columns)), dtype=np.float32)
+            self.user_ids = np.empty(0, dtype=f"S{self.id_width}")
+            self.index_ids = self.user_ids
+            self.index_rows = np.empty(0, dtype=np.int64)
+            return
+        self.features = np.memmap(self._file(FEATURES_FILE), dtype=np.float32, mode='r',
+                                  shape=(self.rows, len(self.columns)))
+        self.user_ids = np.memmap(self._versioned_file(IDS_FILE), dtype=f"S{self.id_width}", mode='r',
+                                  shape=(self.rows,))
+        self.index_ids = np.load(self._versioned_file(INDEX_IDS_FILE), mmap_mode='r')
+        self.index_rows = np.load(self._versioned_file(INDEX_ROWS_FILE), mmap_mode='r')
+
+    def _close(self):
+        # Drop the maps before writing so files can be resized or replaced (required on Windows)
+        self.features = self.user_ids = self.index_ids = self.index_rows = None
+
+    def _save_index(self, all_ids, version):
+        order = np.argsort(all_ids, kind='stable')
+        np.save(self._versioned_file(INDEX_IDS_FILE, version), all_ids[order])
+        np.save(self._versioned_file(INDEX_ROWS_FILE, version), order.astype(np.int64))
+
+    def _remove_stale_files(self):
+        """Delete id and index files of versions other than the committed one"""
+        current = {_versioned(name, self.version) for name in VERSIONED_FILES}
+        for name in os.listdir(self.path):
+            if name.startswith(VERSIONED_PREFIXES) and name not in current:
+                os.remove(self._file(name))
+
+    def clear(self):
+        self._close()
+        for name in os.listdir(self.path):
+            if name in (META_FILE, FEATURES_FILE) or name.startswith(VERSIONED_PREFIXES):
+                os.remove(self._file(name))
+        self.rows = 0
+        self.id_width = 1
+        self.version = 0
+        self._open()
+
+    # ========== Reads ==========
+    def rows_for(self, user_ids):
+        """Row of each user id, or -1 for users not in the store"""
+        return self._rows_for_encoded(_encode_ids(user_ids))
+
+    def _rows_for_encoded(self, ids):
+        rows = np.full(len(ids), -1, dtype=np.int64)
+        if not self.rows or not len(ids):
+            return rows
+        positions = np.minimum(np.searchsorted(self.index_ids, ids), self.rows - 1)
+        found = self.index_ids[positions] == ids
+        rows[found] = self.index_rows[positions[found]]
+        return rows
+
+    def get(self, user_id):
+        """One user's features as {column: value}, or None"""
+        row = self.rows_for([user_id])[0]
+        if row < 0:
+            return None
+        return dict(zip(self.columns, self.features[row].tolist()))
+
+    def matrix(self, columns=None):
+        """All users' features (in row order) for the given columns, as an in-memory float32 array"""
+        if columns is None:
+            return np.array(self.features)
+        return np.array(self.features[:, [self.column_index[c] for c in columns]])
+
+    def user_id_list(self):
+        return np.char.decode(self.user_ids, "utf-8").tolist()
+
+    # ========== Writes ==========
+    def upsert(self, user_ids, values, columns=None):
+        """
+        Write values (one row per user id, one column per entry of columns, default
+        all) for the given users. Existing users only get rows that changed rewritten;
+        new users are appended with 0.0 in the columns not given.
+        Returns (added, changed).
+        """
+        columns = list(columns or self.columns)
+        column_rows = [self.column_index[c] for c in columns]
+        ids = _encode_ids(user_ids)
+        values = np.asarray(values, dtype=np.float32).reshape(len(ids), len(columns))
+        if not len(ids):
+            return 0, 0
+
+        # Last value wins for ids repeated within one call
+        _, last = np.unique(ids[::-1], return_index=True)
+        keep = np.sort(len(ids) - 1 - last)
+        ids, values = ids[keep], values[keep]
+
+        rows = self._rows_for_encoded(ids)
+        existing = rows >= 0
+        current = self.features[rows[existing]][:, column_rows] if existing.any() else values[:0]
+        same = (current == values[existing]) | (np.isnan(current) & np.isnan(values[existing]))
+        changed = rows[existing][~same.all(axis=1)]
+        changed_values = values[existing][~same.all(axis=1)]
+        new_ids, new_values = ids[~existing], values[~existing]
+        if not len(changed) and not len(new_ids):
+            return 0, 0
+
+        old_rows = self.rows
+        self._close()
+        if len(changed):
+            features = np.memmap(self._file(FEATURES_FILE), dtype=np.float32, mode='r+',
+                                 shape=(old_rows, len(self.columns)))
+            features[np.ix_(changed, column_rows)] = changed_values
+            features.flush()
+            del features
+
+        if len(new_ids):
+            new_rows = np.zeros((len(new_ids), len(self.columns)), dtype=np.float32)
+            new_rows[:, column_rows] = new_values
+            row_bytes = len(self.columns) * 4
+            with open(self._file(FEATURES_FILE), 'ab') as f:
+                f.truncate(old_rows * row_bytes)  # drop any tail from an interrupted write
+                f.write(new_rows.tobytes())
+
+            old_ids = (np.fromfile(self._versioned_file(IDS_FILE), dtype=f"S{self.id_width}", count=old_rows)
+                       if old_rows else np.empty(0, dtype=f"S{self.id_width}"))
+            width = max(self.id_width, new_ids.dtype.itemsize)  # a longer id widens every entry
+            all_ids = np.concatenate([old_ids, new_ids]).astype(f"S{width}")
+
+            # New ids and index files are invisible until meta.json names their version
+            version = (self.version or 0) + 1
+            all_ids.tofile(self._versioned_file(IDS_FILE, version))
+            self._save_index(all_ids, version)
+            self.version = version
+            self.id_width = width
+            self.rows = old_rows + len(new_ids)
+            self._write_meta()
+            self._remove_stale_files()
+
+        self._open()
+        return len(new_ids), len(changed)
+
+    def upsert_dicts(self, user_features):
+        """upsert() from {user_id: {column: value}}; missing columns are 0.0"""
+        values = [[row.get(c, 0.0) for c in self.columns] for row in user_features.values()]
+        return self.upsert(list(user_features), values)
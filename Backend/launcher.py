@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import subprocess
+
+# ========== Consumer Worker Launcher ==========
+# Spawns N consumer.py processes in the same Redis consumer group. Redis hands
+# each stream entry to exactly one worker, so throughput scales across cores;
+# run one launcher per node (names include the hostname) to scale across nodes.
+# Clustering and training (--retrain, or the first run on a fresh deploy) happen
+# once here before any worker starts; workers never run trigger.py themselves.
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_FILE = os.path.join(BACKEND_DIR, "cluster_models", "manifest.json")
+LEGACY_MAPPING_FILE = os.path.join(BACKEND_DIR, "user_cluster_mapping.json")
+
+# A crash-looping worker is restarted after 1s, 2s, 4s... up to a minute; the delay
+# resets once a worker has stayed up for RESTART_RESET_S
+RESTART_DELAY_S = 1.0
+MAX_RESTART_DELAY_S = 60.0
+RESTART_RESET_S = 60.0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run several fraud scoring consumers in one consumer group")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of consumer processes to start (default: CPU count)")
+    parser.add_argument("--group", default="fraud_scorers", help="Redis consumer group name")
+    parser.add_argument("--retrain", action="store_true",
+                        help="Recluster and retrain all models once before starting the workers")
+    args, consumer_args = parser.parse_known_args()
+    return args, consumer_args
+
+def run_trigger():
+    subprocess.run([sys.executable, os.path.join(BACKEND_DIR, "trigger.py")], check=True)
+
+def spawn_worker(index, group, consumer_args):
+    name = f"{socket.gethostname()}-worker-{index}"
+    cmd = [sys.executable, "consumer.py", "--group", group, "--consumer-name", name,
+           "--wait-for-models", *consumer_args]
+    print(f"🚀 Starting {name}")
+    return subprocess.Popen(cmd, cwd=BACKEND_DIR)
+
+if __name__ == "__main__":
+    args, consumer_args = parse_args()
+    if args.retrain:
+        print("🔁 Triggering cluster re-training...")
+        run_trigger()
+    elif not os.path.exists(MANIFEST_FILE) and not os.path.exists(LEGACY_MAPPING_FILE):
+        print("⚠️ No existing cluster mapping found, running full clustering...")
+        run_trigger()
+
+    workers = {i: spawn_worker(i, args.group, consumer_args) for i in range(args.workers)}
+    started = {i: time.monotonic() for i in workers}
+    delays = {i: RESTART_DELAY_S for i in workers}
+    restart_at = {}  # worker index → when to restart it
+
+    try:
+        while True:
+            time.sleep(1)
+            now = time.monotonic()
+            for i, proc in list(workers.items()):
+                if i in restart_at:
+                    if now >= restart_at[i]:
+                        del restart_at[i]
+                        # Same name on restart so the group's consumer list does not grow with every crash
+                        workers[i] = spawn_worker(i, args.group, consumer_args)
+                        started[i] = now
+                    continue
+                code = proc.poll()
+                if code is not None:
+                    if now - started[i] >= RESTART_RESET_S:
+                        delays[i] = RESTART_DELAY_S
+                    print(f"⚠️ Worker {i} exited with code {code}, restarting in {delays[i]:.0f}s")
+                    restart_at[i] = now + delays[i]
+                    delays[i] = min(delays[i] * 2, MAX_RESTART_DELAY_S)
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping workers...")
+        running = [proc for i, proc in workers.items() if i not in restart_at]
+        for proc in running:
+            proc.send_signal(signal.SIGINT)  # lets each worker finish its batch and exit cleanly
+        for proc in running:
+            proc.wait()
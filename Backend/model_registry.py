@@ -0,0 +1,414 @@
+import os
+import re
+import json
+import time
+import threading
+import joblib
+import numpy as np
+from collections import OrderedDict
+from fast_iforest import CompiledIsolationForest, check_parity
+from cluster_index import UserClusterIndex
+from redis_features import assignments_key
+from scoring import FEATURE_KEYS
+
+BUNDLE_PATTERN = re.compile(r"^cluster_(-?\d+)_bundle\.pkl$")
+MANIFEST_NAME = "manifest.json"
+MAX_ASSIGNED_USERS = 100000
+
+class AssignedClusters:
+    """Bounded user id → cluster map of online assignments; least recently used users are evicted first"""
+
+    def __init__(self, max_size=MAX_ASSIGNED_USERS):
+        self.max_size = max_size
+        self._clusters = OrderedDict()
+        self._lock = threading.Lock()  # scoring threads of the async consumer share it
+
+    def __len__(self):
+        return len(self._clusters)
+
+    def __contains__(self, user_id):
+        return user_id in self._clusters
+
+    def get(self, user_id, default=None):
+        with self._lock:
+            cluster = self._clusters.get(user_id)
+            if cluster is None:
+                return default
+            self._clusters.move_to_end(user_id)
+            return cluster
+
+    def __setitem__(self, user_id, cluster):
+        with self._lock:
+            self._clusters[user_id] = cluster
+            self._clusters.move_to_end(user_id)
+            while len(self._clusters) > self.max_size:
+                self._clusters.popitem(last=False)
+
+class SharedAssignments:
+    """
+    Online cluster assignments of one model generation, kept in a Redis hash so
+    every consumer process, and every restart, scores a new user against the same
+    cluster. The first process to place a user wins (HSETNX); the others read its
+    choice back.
+    """
+
+    def __init__(self, r, generation):
+        self.r = r
+        self.key = assignments_key(generation)
+
+    def lookup(self, user_ids):
+        """
+        One round trip: ({user id: stored cluster}, {user id: profile feature row}).
+        Rows are built from user:{id} the way trigger.py syncs profiles into the
+        feature store; users without a written-back profile get no row.
+        """
+        pipe = self.r.pipeline(transaction=False)
+        pipe.hmget(self.key, user_ids)
+        for user_id in user_ids:
+            pipe.hmget(f"user:{user_id}", FEATURE_KEYS)
+        stored, *profiles = pipe.execute()
+
+        clusters = {user_id: int(c) for user_id, c in zip(user_ids, stored) if c is not None}
+        rows = {}
+        for user_id, values in zip(user_ids, profiles):
+            if user_id in clusters or values[FEATURE_KEYS.index("Avg_Amount")] is None:
+                continue  # already placed, or no Legit transaction written back yet
+            rows[user_id] = [float(v) if v is not None else 0.0 for v in values]
+        return clusters, rows
+
+    def store(self, clusters):
+        """Record {user id: cluster} unless another process got there first; returns the stored clusters"""
+        pipe = self.r.pipeline(transaction=False)
+        for user_id, cluster in clusters.items():
+            pipe.hsetnx(self.key, user_id, int(cluster))
+        pipe.hmget(self.key, list(clusters))
+        stored = pipe.execute()[-1]
+        return {user_id: int(c) for user_id, c in zip(clusters, stored)}
+
+class ModelGeneration:
+    """
+    One immutable set of cluster models, fallback model and user → cluster mapping,
+    plus the clusters assigned online to users the mapping doesn't contain
+    """
+
+    def __init__(self, version, models, fallback_model, fallback_scaler, user_cluster_map,
+                 max_assigned=MAX_ASSIGNED_USERS, shared=None):
+        self.version = version
+        self.models = models
+        self.fallback_model = fallback_model
+        self.fallback_scaler = fallback_scaler
+        self.user_cluster_map = user_cluster_map
+        self.assigner = None  # set by a background thread once loaded and warmed up
+        self.shared = shared  # SharedAssignments, or None without online assignment
+        self.assigned = AssignedClusters(max_assigned)  # local cache of the shared assignments
+
+    # ========== Lookup ==========
+    def cluster_for(self, user_id):
+        """Return the user's cluster id, or None if unmapped or noise"""
+        cluster_info = self.user_cluster_map.get(user_id)
+        cluster = cluster_info["Cluster"] if cluster_info else self.assigned.get(user_id)
+        if cluster == -1:
+            cluster = None  # treat as unassigned → fallback
+        return cluster
+
+    def assign_new_users(self, user_ids):
+        """
+        Find a cluster for users the mapping doesn't contain. Clusters another process
+        already chose are read from Redis; users with a profile hash but no cluster yet
+        are placed by the assigner from that profile, so one outlying first transaction
+        doesn't decide their cluster. Users without a profile stay on the fallback
+        model until a Legit transaction writes one back.
+        """
+        if self.shared is None:
+            return 0
+        pending = [user_id for user_id in dict.fromkeys(user_ids)
+                   if user_id not in self.user_cluster_map and user_id not in self.assigned]
+        if not pending:
+            return 0
+
+        started = time.perf_counter()
+        try:
+            clusters, rows = self.shared.lookup(pending)
+            assigner = self.assigner
+            if rows and assigner is not None:
+                placed = assigner.assign(list(rows.values()))
+                clusters.update(self.shared.store(dict(zip(rows, (int(c) for c in placed)))))
+        except Exception as e:
+            print(f"⚠️ Could not assign {len(pending)} new users to clusters: {e}")
+            return 0
+        for user_id, cluster in clusters.items():
+            self.assigned[user_id] = cluster
+        if clusters:
+            print(f"🧭 Assigned {len(clusters)} new users to clusters {sorted(set(clusters.values()))} "
+                  f"in {(time.perf_counter() - started) * 1000:.2f} ms")
+        return len(clusters)
+
+    def has_cluster(self, cluster):
+        return cluster in self.models
+
+    @property
+    def has_fallback(self):
+        return self.fallback_model is not None and self.fallback_scaler is not None
+
+    # ========== Scoring ==========
+    def score(self, cluster, X):
+        """Return normalized anomaly scores (0 = normal, 1 = training max) for each row of X"""
+        bundle = self.models.get(cluster)
+        if bundle is None:
+            raise KeyError(f"No model loaded for cluster {cluster}")
+
+        model, scaler, score_min, score_max = bundle
+        X_scaled = scaler.transform(np.atleast_2d(X))
+        scores = model.decision_function(X_scaled)
+
+        # Normalize using actual training score range
+        if score_max != score_min:
+            return (scores - score_min) / (score_max - score_min)
+        return np.full(len(scores), 0.5)  # fallback if all training scores were same
+
+    def predict_fallback(self, X):
+        """Return fallback XGBoost class predictions for each row of X"""
+        if not self.has_fallback:
+            raise KeyError("No fallback model loaded")
+        X_scaled = self.fallback_scaler.transform(np.atleast_2d(X))
+        return self.fallback_model.predict(X_scaled)
+
+class ClusterModelRegistry:
+    """
+    Keeps every per-cluster Isolation Forest bundle and the fallback
+    XGBoost model resident in memory so the consumer never unpickles
+    a model on the hot path.
+
+    trigger.py writes each retrain to its own generation directory and then
+    publishes it by replacing the model directory's manifest.json, which
+    names every file of the generation. reload_if_changed() picks it up and swaps
+    the whole generation in a single assignment, so a message is always
+    scored against one consistent set of models and cluster mapping.
+
+    Users missing from the mapping are placed into an existing cluster by
+    the generation's persisted UMAP + HDBSCAN assigner (assign_new_users),
+    from their Redis profile, instead of going to the fallback model. The
+    choice is shared through Redis (redis_client), so every consumer scores
+    a user against the same cluster. The assigner is loaded and warmed up on
+    a background thread, so startup and hot swaps stay fast; until it is
+    ready new users use the fallback model.
+    """
+
+    SCORERS = ("sklearn", "numpy")
+
+    def __init__(self, model_dir="cluster_models", cluster_map_file="user_cluster_mapping.json",
+                 check_interval=5.0, scorer="sklearn", assign_new_users=True,
+                 max_assigned=MAX_ASSIGNED_USERS, redis_client=None):
+        if scorer not in self.SCORERS:
+            raise ValueError(f"Unknown scorer {scorer!r}, expected one of {self.SCORERS}")
+        self.scorer = scorer
+        self.redis_client = redis_client
+        self.online_assignment = assign_new_users
+        if self.online_assignment and redis_client is None:
+            print("⚠️ Online cluster assignment needs a Redis client, new users will use the fallback model")
+            self.online_assignment = False
+        self.max_assigned = max_assigned
+        if self.online_assignment:
+            self._launch_numba_threads()
+        self.model_dir = model_dir
+        self.cluster_map_file = cluster_map_file
+        self.manifest_path = os.path.join(model_dir, MANIFEST_NAME)
+        self.check_interval = check_interval
+        self._last_check = 0.0
+        self._manifest_mtime = None
+        self.current = self._load_generation()
+
+    # ========== Loading ==========
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not read model manifest: {e}")
+            return {}
+
+    def _manifest_stat(self):
+        try:
+            return os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _manifest_file(self, manifest, key, default=None):
+        """Path of a file the manifest names; files in generation directories are relative to model_dir"""
+        file = manifest.get(key, default)
+        if file and "directory" in manifest:
+            return os.path.join(self.model_dir, file)
+        return file
+
+    def _bundle_files(self, manifest):
+        if "bundles" in manifest:
+            return {int(c): file for c, file in manifest["bundles"].items()}
+        if "clusters" in manifest:
+            return {int(c): f"cluster_{c}_bundle.pkl" for c in manifest["clusters"]}
+
+        # No manifest yet: fall back to whatever bundles are in the directory
+        files = {}
+        if os.path.isdir(self.model_dir):
+            for file in sorted(os.listdir(self.model_dir)):
+                match = BUNDLE_PATTERN.match(file)
+                if match:
+                    files[int(match.group(1))] = file
+        return files
+
+    def _load_cluster_map(self, manifest):
+        # Prefer the memory-mapped index: O(1) to open and shared between forked workers
+        index_path = self._manifest_file(manifest, "cluster_index")
+        if index_path and os.path.exists(index_path):
+            try:
+                return UserClusterIndex(index_path)
+            except Exception as e:
+                print(f"⚠️ Could not open cluster index {index_path}, loading the JSON mapping: {e}")
+
+        path = self._manifest_file(manifest, "cluster_map_file", self.cluster_map_file)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                return json.load(f)
+        return {}
+
+    def _launch_numba_threads(self):
+        """
+        Start numba's thread pool on this thread. Otherwise UMAP's parallel kernels
+        start it from the assigner loader thread, and a pool started off the main
+        thread hangs the interpreter at exit.
+        """
+        try:
+            import numba
+            numba.get_num_threads()
+        except Exception as e:
+            print(f"⚠️ numba unavailable, new users will use the fallback model: {e}")
+            self.online_assignment = False
+
+    def _start_assigner_load(self, generation, manifest):
+        file = manifest.get("assigner")
+        if not file or not self.online_assignment:
+            return None
+        thread = threading.Thread(target=self._load_assigner, args=(generation, os.path.join(self.model_dir, file)),
+                                  name=f"assigner-load-{generation.version}", daemon=True)
+        thread.start()
+        return thread
+
+    def _load_assigner(self, generation, path):
+        """Import UMAP/HDBSCAN, unpickle and warm up the assigner, then hand it to the generation"""
+        started = time.perf_counter()
+        try:
+            assigner = joblib.load(path)
+            warm_up_seconds = assigner.warm_up()
+        except Exception as e:
+            print(f"⚠️ Failed to load cluster assigner, new users will use the fallback model: {e}")
+            return
+        generation.assigner = assigner
+        print(f"🧭 Cluster assigner ({assigner.method}) for generation {generation.version} ready in "
+              f"{time.perf_counter() - started:.2f}s (warm-up {warm_up_seconds:.2f}s)")
+
+    def _compile(self, cluster_id, model):
+        """Swap in the NumPy scorer for a model, keeping sklearn if the two ever disagree"""
+        try:
+            compiled = CompiledIsolationForest(model)
+            ok, diff = check_parity(model, compiled)
+        except Exception as e:
+            print(f"⚠️ Could not compile cluster {cluster_id} model, using sklearn: {e}")
+            return model
+        if not ok:
+            print(f"⚠️ Compiled cluster {cluster_id} model differs from sklearn by {diff:.2e}, using sklearn")
+            return model
+        return compiled
+
+    def _load_generation(self):
+        self._manifest_mtime = self._manifest_stat()
+        manifest = self._read_manifest()
+        version = manifest.get("generation", 0)
+
+        models = {}
+        for cluster_id, file in self._bundle_files(manifest).items():
+            try:
+                model, scaler, score_min, score_max = joblib.load(os.path.join(self.model_dir, file))
+                if self.scorer == "numpy":
+                    model = self._compile(cluster_id, model)
+                models[cluster_id] = (model, scaler, float(score_min), float(score_max))
+            except Exception as e:
+                print(f"⚠️ Failed to load bundle for cluster {cluster_id}: {e}")
+
+        try:
+            fallback_model = joblib.load(os.path.join(self.model_dir, "fallback_xgboost_model.joblib"))
+            fallback_scaler = joblib.load(os.path.join(self.model_dir, "fallback_scaler.joblib"))
+            print("✅ Loaded fallback XGBoost model and scaler")
+        except FileNotFoundError:
+            print("❌ Fallback model or scaler not found.")
+            fallback_model = None
+            fallback_scaler = None
+
+        user_cluster_map = self._load_cluster_map(manifest)
+        print(f"✅ Loaded model generation {version}: {len(models)} cluster models {sorted(models)} "
+              f"({self.scorer} scorer), {len(user_cluster_map)} mapped users")
+        shared = SharedAssignments(self.redis_client, version) if self.online_assignment else None
+        generation = ModelGeneration(version, models, fallback_model, fallback_scaler, user_cluster_map,
+                                     self.max_assigned, shared)
+        self._start_assigner_load(generation, manifest)
+        return generation
+
+    def load_if_changed(self, force=False):
+        """
+        Load the published generation if the manifest changed since the last load,
+        without swapping it in. Returns the generation, or None. Safe to run off the
+        thread that scores, as long as only one load runs at a time.
+        """
+        mtime = self._manifest_stat()
+        if not force and (mtime is None or mtime == self._manifest_mtime):
+            return None
+        try:
+            return self._load_generation()
+        except Exception as e:
+            print(f"❌ Failed to load new model generation, keeping generation {self.current.version}: {e}")
+            return None
+
+    def swap(self, generation):
+        previous = self.current.version
+        self.current = generation
+        print(f"🔄 Hot-swapped models: generation {previous} → {generation.version}")
+
+    def reload_if_changed(self, force=False):
+        """Load and swap in a newly published model generation. Returns True if a swap happened."""
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+
+        generation = self.load_if_changed(force)
+        if generation is None:
+            return False
+        self.swap(generation)
+        return True
+
+    # ========== Lookup & Scoring ==========
+    # Each call reads the current generation once. Callers that need several calls
+    # against the same generation (e.g. scoring a wave while a reload may swap in
+    # another one) use registry.current directly, which has the same methods.
+    @property
+    def user_cluster_map(self):
+        return self.current.user_cluster_map
+
+    def cluster_for(self, user_id):
+        return self.current.cluster_for(user_id)
+
+    def assign_new_users(self, users):
+        return self.current.assign_new_users(users)
+
+    def has_cluster(self, cluster):
+        return self.current.has_cluster(cluster)
+
+    @property
+    def has_fallback(self):
+        return self.current.has_fallback
+
+    def score(self, cluster, X):
+        return self.current.score(cluster, X)
+
+    def predict_fallback(self, X):
+        return self.current.predict_fallback(X)
@@ -0,0 +1,129 @@
+import time
+import queue
+import threading
+from collections import defaultdict
+from pymongo.errors import BulkWriteError
+
+_STOP = object()
+
+class BulkMongoWriter:
+    """
+    Background writer that batches inserts into insert_many(ordered=False).
+
+    submit() only enqueues, so the scoring loop never waits on a Mongo round trip.
+    The queue is bounded: when Mongo falls behind, submit() blocks (backpressure)
+    instead of letting memory grow. A batch is flushed when it reaches batch_size
+    documents or flush_interval seconds after its first document arrived.
+
+    Each document may carry an opaque token; on_flushed(tokens) is called from
+    the writer thread with the tokens of documents that were written successfully.
+    """
+
+    def __init__(self, db, batch_size=500, flush_interval=0.2, max_queue=10000, on_flushed=None):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_flushed = on_flushed
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.total_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+        self._thread = threading.Thread(target=self._run, name="mongo-writer", daemon=True)
+        self._thread.start()
+
+    # ========== Producer Side ==========
+    def submit(self, collection, doc, token=None, timeout=None):
+        """Queue a document; blocks while the queue is full (raises queue.Full after timeout)"""
+        self.queue.put((collection, doc, token), timeout=timeout)
+
+    def flush(self):
+        """Block until every document submitted so far has been written"""
+        self.queue.join()
+
+    def close(self):
+        """Flush remaining documents and stop the writer thread"""
+        self.queue.put(_STOP)
+        self._thread.join()
+
+    @property
+    def backlog(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return {
+            "written": self.written,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "avg_flush_ms": round(self.total_latency_ms / self.flushes, 2) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_latency_ms, 2),
+            "backlog": self.backlog
+        }
+
+    # ========== Writer Thread ==========
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is _STOP:
+                self.queue.task_done()
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self.queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write(self, batch):
+        by_collection = defaultdict(list)
+        for collection, doc, token in batch:
+            by_collection[collection].append((doc, token))
+
+        started = time.perf_counter()
+        written_tokens = []
+        for collection, entries in by_collection.items():
+            docs = [doc for doc, _ in entries]
+            failed_indices = set()
+            try:
+                self.db[collection].insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                failed_indices = {err["index"] for err in e.details.get("writeErrors", [])}
+                print(f"⚠️ {len(failed_indices)} of {len(docs)} inserts into {collection} failed")
+            except Exception as e:
+                failed_indices = set(range(len(docs)))
+                print(f"❌ Bulk insert into {collection} failed: {e}")
+
+            self.failed += len(failed_indices)
+            self.written += len(docs) - len(failed_indices)
+            written_tokens.extend(token for i, (_, token) in enumerate(entries)
+                                  if i not in failed_indices and token is not None)
+
+        latency_ms = (time.perf_counter() - started) * 1000
+        self.flushes += 1
+        self.total_latency_ms += latency_ms
+        self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+        print(f"💾 Wrote {len(batch)} documents to MongoDB in {latency_ms:.2f} ms (backlog {self.backlog})")
+
+        if self.on_flushed and written_tokens:
+            try:
+                self.on_flushed(written_tokens)
+            except Exception as e:
+                print(f"❌ Flush callback failed: {e}")
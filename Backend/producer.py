@@ -1,7 +1,7 @@
 import redis
 import pandas as pd
 import time
-import ast
+from wire_format import encode_transaction
 
 # Connect to Redis
 r = redis.Redis(host='localhost', port=6379, decode_responses=True)
@@ -29,7 +29,7 @@ for idx, row in df.iterrows():
     }
 
     # Push dictionary to Redis stream
-    r.xadd(stream_key, {"data": str(row_dict)})
+    r.xadd(stream_key, encode_transaction(row_dict))
     print(f"📤 Sent row {idx+1}/{len(df)} -> {row_dict['User_ID']} at {row_dict['Date']} {row_dict['Time']}")
     time.sleep(1)
 
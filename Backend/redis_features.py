@@ -0,0 +1,334 @@
+import hashlib
+import calendar
+from datetime import datetime
+
+# Set of every user id with state in Redis, so trigger.py can sync profiles
+# without scanning the per-user window keys
+USER_SET_KEY = "user_ids"
+# Set once trigger.py has backfilled USER_SET_KEY from a full SCAN. Consumers add
+# ids as they write, so the set existing doesn't mean it holds every user
+USER_SET_BACKFILLED_KEY = "user_ids:backfilled"
+
+def assignments_key(generation):
+    """Hash of user id → cluster placed online by the consumers, one per model generation"""
+    return f"cluster_assignments:{generation}"
+
+# ========== Sliding Windows ==========
+# Each user's transaction counts live in one user:{id}:windows:{layout} string,
+# read and updated with BITFIELD as an array of u32 slots. Every horizon is a
+# ring of time buckets laid out as
+#
+#   [last period, window total, bucket 0, ..., bucket n-1]
+#
+# where bucket i counts the transactions of the periods p with p % n == i. An
+# event clears the buckets of the periods that slid out since the last event
+# (subtracting them from the total), then bumps its own bucket and the total, so
+# the total is always the count over the last n periods: O(1) per event
+# (amortized, at most n buckets cleared) and a fixed 4 * (n + 2) bytes per ring.
+# Granularity is one bucket: the 24h count covers the current 15-minute bucket
+# and the 95 before it.
+#
+# Slots are positional, so the key carries a signature of the WINDOWS layout:
+# editing a horizon starts new rings under a new key instead of misreading the
+# old ones, which expire with WINDOW_KEY_TTL_S.
+WINDOWS = {
+    "1h": (60, 60),       # bucket seconds, buckets
+    "24h": (900, 96),
+    "30d": (86400, 30)
+}
+WINDOW_KEY_TTL_S = 31 * 24 * 3600  # past the longest horizon every count is 0 anyway
+WINDOWS_LAYOUT = hashlib.sha1(repr(list(WINDOWS.items())).encode()).hexdigest()[:8]
+
+# Feature → horizon of WINDOWS whose count it reports
+WINDOW_FEATURES = {
+    "Transactions_Per_Day": "24h",
+    "Velocity": "30d",
+    "Transactions_Last_Hour": "1h"
+}
+_unknown_horizons = set(WINDOW_FEATURES.values()) - set(WINDOWS)
+if _unknown_horizons:
+    raise ValueError(f"WINDOW_FEATURES uses horizons missing from WINDOWS: {sorted(_unknown_horizons)}")
+
+def window_key(user_id):
+    return f"user:{user_id}:windows:{WINDOWS_LAYOUT}"
+
+# ========== Dynamic Feature Script ==========
+# Reads the user's profile, slides and bumps their window counts, records a
+# large transaction and registers the user id in one atomic server-side call.
+#   KEYS: user hash, window key, user id set
+#   ARGV: amount, transaction date, user id, event epoch seconds, window key TTL,
+#         then bucket seconds and bucket count of each horizon
+# Avg_Amount is rounded with %.2f, which matches Python's round(x, 2).
+DYNAMIC_FEATURES_LUA = """
+local function slide(key, slot, bucket_s, n, now)
+    local period = math.floor(now / bucket_s)
+    local header = redis.call('BITFIELD', key, 'GET', 'u32', '#' .. slot, 'GET', 'u32', '#' .. (slot + 1))
+    local last, total = header[1], header[2]
+    local ops = {}
+
+    if last == 0 or period - last >= n then
+        -- First event, or every bucket slid out: reset the ring
+        if total > 0 then
+            for i = 0, n - 1 do
+                table.insert(ops, 'SET'); table.insert(ops, 'u32'); table.insert(ops, '#' .. (slot + 2 + i)); table.insert(ops, 0)
+            end
+        end
+        total = 0
+        last = period
+    elseif period > last then
+        -- Clear the buckets of the periods that slid out since the last event
+        local reads = {}
+        for p = last + 1, period do
+            table.insert(reads, 'GET'); table.insert(reads, 'u32'); table.insert(reads, '#' .. (slot + 2 + p % n))
+        end
+        local stale = redis.call('BITFIELD', key, unpack(reads))
+        for i, p in ipairs(stale) do
+            total = total - p
+            table.insert(ops, 'SET'); table.insert(ops, 'u32'); table.insert(ops, '#' .. (slot + 2 + (last + i) % n)); table.insert(ops, 0)
+        end
+        last = period
+    elseif last - period >= n then
+        return total  -- late event older than the whole window
+    end
+
+    total = total + 1
+    for _, op in ipairs({'INCRBY', 'u32', '#' .. (slot + 2 + period % n), 1,
+                         'SET', 'u32', '#' .. slot, last,
+                         'SET', 'u32', '#' .. (slot + 1), total}) do
+        table.insert(ops, op)
+    end
+    redis.call('BITFIELD', key, unpack(ops))
+    return total
+end
+
+local avg_raw = redis.call('HGET', KEYS[1], 'Avg_Amount')
+local last_large = redis.call('HGET', KEYS[1], 'Last_Large_Date')
+local ltf_raw = redis.call('HGET', KEYS[1], 'Large_Transaction_Frequency')
+
+local now = tonumber(ARGV[4])
+local counts = {}
+local slot = 0
+for i = 6, #ARGV, 2 do
+    local bucket_s, n = tonumber(ARGV[i]), tonumber(ARGV[i + 1])
+    table.insert(counts, slide(KEYS[2], slot, bucket_s, n, now))
+    slot = slot + n + 2
+end
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+
+local amount = tonumber(ARGV[1])
+local avg = tonumber(avg_raw or '0') or 0
+local new_avg = amount
+if avg > 0 then
+    new_avg = tonumber(string.format('%.2f', (avg + amount) / 2))
+end
+
+local large = 0
+if amount > 1.5 * new_avg then
+    large = 1
+    redis.call('HSET', KEYS[1], 'Last_Large_Date', ARGV[2])
+end
+redis.call('SADD', KEYS[3], ARGV[3])
+
+return {avg_raw or '', last_large or '', ltf_raw or '', counts, large}
+"""
+WINDOW_ARGS = [value for horizon in WINDOWS.values() for value in horizon]
+
+class DynamicFeatureStore:
+    """Computes the consumer's per-user dynamic features in one Redis round trip"""
+
+    def __init__(self, r):
+        self.r = r
+        self.script = r.register_script(DYNAMIC_FEATURES_LUA)
+
+    @staticmethod
+    def script_inputs(user_id, amount, date_str, time_str):
+        dt = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M:%S")
+        keys = [f"user:{user_id}", window_key(user_id), USER_SET_KEY]
+        args = [repr(float(amount)), date_str, str(user_id), calendar.timegm(dt.timetuple()), WINDOW_KEY_TTL_S]
+        return dt, keys, args + WINDOW_ARGS
+
+    @staticmethod
+    def features_from_reply(reply, amount, dt):
+        avg_raw, last_large_date, ltf_raw, counts, large_txn_flag = reply
+        window_counts = dict(zip(WINDOWS, (int(c) for c in counts)))
+
+        avg_amt = float(avg_raw or 0)
+        avg_amt = round((avg_amt + amount) / 2, 2) if avg_amt > 0 else amount
+
+        previous_ltf = float(ltf_raw or 30.0)
+        large_txn_flag = int(large_txn_flag)
+        if large_txn_flag:
+            if last_large_date:
+                last = datetime.strptime(last_large_date, "%Y-%m-%d")
+                days_between = (dt - last).days
+            else:
+                days_between = 30
+        else:
+            days_between = previous_ltf
+
+        ltf = round((days_between + previous_ltf) / 2, 2)
+
+        features = {
+            "Avg_Amount": avg_amt,
+            "Large_Transaction_Flag": large_txn_flag,
+            "Large_Transaction_Frequency": ltf
+        }
+        for feature, horizon in WINDOW_FEATURES.items():
+            features[feature] = float(window_counts[horizon])
+        return features
+
+    def compute(self, user_id, amount, date_str, time_str):
+        dt, keys, args = self.script_inputs(user_id, amount, date_str, time_str)
+        return self.features_from_reply(self.script(keys=keys, args=args), amount, dt)
+
+    def compute_many(self, transactions):
+        """
+        Compute features for (user_id, amount, date_str, time_str) tuples in one
+        pipelined round trip. Failed entries come back as the Exception instance.
+        """
+        results = [None] * len(transactions)
+        pending = []
+        pipe = self.r.pipeline(transaction=False)
+        for i, (user_id, amount, date_str, time_str) in enumerate(transactions):
+            try:
+                dt, keys, args = self.script_inputs(user_id, amount, date_str, time_str)
+            except Exception as e:
+                results[i] = e
+                continue
+            self.script(keys=keys, args=args, client=pipe)
+            pending.append((i, amount, dt))
+
+        if pending:
+            replies = pipe.execute(raise_on_error=False)
+            for (i, amount, dt), reply in zip(pending, replies):
+                if isinstance(reply, Exception):
+                    results[i] = reply
+                    continue
+                try:
+                    results[i] = self.features_from_reply(reply, amount, dt)
+                except Exception as e:
+                    results[i] = e
+        return results
+
+class AsyncDynamicFeatureStore:
+    """redis.asyncio counterpart of DynamicFeatureStore, used by async_consumer.py"""
+
+    def __init__(self, r):
+        self.r = r
+        self.script = r.register_script(DYNAMIC_FEATURES_LUA)
+
+    async def compute_many(self, transactions):
+        results = [None] * len(transactions)
+        pending = []
+        pipe = self.r.pipeline(transaction=False)
+        for i, (user_id, amount, date_str, time_str) in enumerate(transactions):
+            try:
+                dt, keys, args = DynamicFeatureStore.script_inputs(user_id, amount, date_str, time_str)
+            except Exception as e:
+                results[i] = e
+                continue
+            await self.script(keys=keys, args=args, client=pipe)
+            pending.append((i, amount, dt))
+
+        if pending:
+            replies = await pipe.execute(raise_on_error=False)
+            for (i, amount, dt), reply in zip(pending, replies):
+                if isinstance(reply, Exception):
+                    results[i] = reply
+                    continue
+                try:
+                    results[i] = DynamicFeatureStore.features_from_reply(reply, amount, dt)
+                except Exception as e:
+                    results[i] = e
+        return results
+
+# ========== Counter Rollup ==========
+# Folds one legacy per-period counter into the user's summary hash and deletes
+# it, atomically, so a rerun or a concurrent job never counts it twice. Counter
+# keys are named after the transaction's date, not the time they were written
+# (replayed CSVs carry historical dates), so staleness comes from the key itself:
+# time since the last write from its remaining TTL, or OBJECT IDLETIME (time
+# since the last read or write) for counters written without one. Counters a
+# consumer touched within their read window are left alone.
+#   KEYS: counter key, user:{id}:history
+#   ARGV: unit ("day" or "month"), period (YYYY-MM-DD or YYYY-MM),
+#         TTL the counter was written with, read window in seconds
+# Returns 1 if rolled up, 0 if the key is gone, -1 if it is still in use.
+ROLLUP_LUA = """
+local ttl = redis.call('TTL', KEYS[1])
+if ttl == -2 then
+    return 0
+end
+local idle
+if ttl >= 0 then
+    idle = tonumber(ARGV[3]) - ttl
+else
+    idle = redis.call('OBJECT', 'IDLETIME', KEYS[1])
+end
+if idle < tonumber(ARGV[4]) then
+    return -1
+end
+
+local count = tonumber(redis.call('HGET', KEYS[1], 'count') or '0')
+redis.call('DEL', KEYS[1])
+local unit = ARGV[1]
+redis.call('HINCRBY', KEYS[2], unit .. 's_active', 1)
+redis.call('HINCRBY', KEYS[2], unit .. '_tx_total', count)
+local first = redis.call('HGET', KEYS[2], 'first_' .. unit)
+if not first or ARGV[2] < first then
+    redis.call('HSET', KEYS[2], 'first_' .. unit, ARGV[2])
+end
+local last = redis.call('HGET', KEYS[2], 'last_' .. unit)
+if not last or ARGV[2] > last then
+    redis.call('HSET', KEYS[2], 'last_' .. unit, ARGV[2])
+end
+return 1
+"""
+
+# TTL each legacy counter was written with, and how long after its last write a
+# consumer of the key-per-period layout may still read it
+LEGACY_COUNTER_TTL_S = {"day": 3 * 24 * 3600, "month": 35 * 24 * 3600}
+LEGACY_READ_WINDOW_S = {"day": 2 * 24 * 3600, "month": 31 * 24 * 3600}
+
+COUNTER_UNITS = {"tx": "day", "velocity": "month"}
+
+def history_key(user_id):
+    return f"user:{user_id}:history"
+
+def rollup_counters(r, batch_size=1000):
+    """
+    Compact the user:{id}:tx:{date} and user:{id}:velocity:{month} counters of the
+    old key-per-period layout into per-user user:{id}:history summaries (days/months
+    active, transaction totals, first and last period). The dynamic feature script
+    no longer reads or writes them, and ones written before TTLs were added never
+    expire on their own. Counters still within a consumer's read window (during a
+    rolling upgrade) are skipped. Returns {"day": n, "month": n, "live": n}: counters
+    rolled up per unit, and counters skipped as still in use.
+    """
+    script = r.register_script(ROLLUP_LUA)
+    rolled = {"day": 0, "month": 0, "live": 0}
+
+    def flush(batch):
+        pipe = r.pipeline(transaction=False)
+        for key, user_id, unit, period in batch:
+            script(keys=[key, history_key(user_id)],
+                   args=[unit, period, LEGACY_COUNTER_TTL_S[unit], LEGACY_READ_WINDOW_S[unit]], client=pipe)
+        for (_, _, unit, _), done in zip(batch, pipe.execute()):
+            if int(done) < 0:
+                rolled["live"] += 1
+            else:
+                rolled[unit] += int(done)
+
+    batch = []
+    for key in r.scan_iter("user:*:*", count=batch_size):
+        key = key.decode() if isinstance(key, bytes) else key
+        parts = key.split(":")
+        if len(parts) != 4 or parts[2] not in COUNTER_UNITS:
+            continue
+        batch.append((key, parts[1], COUNTER_UNITS[parts[2]], parts[3]))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    return rolled
@@ -0,0 +1,160 @@
+import numpy as np
+from collections import defaultdict
+from wire_format import decode_transaction, MalformedMessage
+
+# ========== Shared Scoring Logic ==========
+# Used by both consumer.py and async_consumer.py
+
+# ========== Merchant & Device Encoding ==========
+MERCHANT_MAP = {
+    'Luxury Goods': 0,
+    'Travel': 1,
+    'Electronics': 2,
+    'Apparel': 3,
+    'Food Delivery': 4,
+    'Online Services': 5,
+    'Groceries': 6,
+    'Utilities': 7,
+    'Medical': 8,
+    'Wellness': 9,
+    'Organic Grocery': 10,
+    'Jewelry': 11,
+    'Health': 12,
+    'Hygiene Products': 13,
+    'Apparel (gifts)': 14,
+    'Food': 15,
+    'Apparel Deals': 16
+}
+DEVICE_MAP = {'Mobile': 0, 'PC': 1, 'Tablet': 2}
+PAYMENT_METHOD_MAP = {'Credit Card': 0, 'Debit Card': 1, 'UPI': 2, 'Net Banking': 3, 'Wallet': 4}
+
+# ========== Message Handling ==========
+def parse_transaction(msg_data):
+    """Decode a stream entry into a transaction dict, or None if it is malformed"""
+    try:
+        return decode_transaction(msg_data)
+    except MalformedMessage as e:
+        print(f"⚠️ Skipping malformed message: {e}")
+        return None
+
+# Order of build_feature_vector() and of the cluster features trigger.py fits on
+FEATURE_KEYS = [
+    "Amount", "Avg_Amount", "Active_Loan_Count", "Session_Time", "Transactions_Per_Day", "Velocity",
+    "Large_Transaction_Flag", "Large_Transaction_Frequency", "Merchant_Type_Code", "Device_Type_Code"
+]
+
+def build_feature_vector(tx, features):
+    return {
+        "Amount": float(tx.get("Amount", 0.0)),
+        "Avg_Amount": features["Avg_Amount"],
+        "Active_Loan_Count": int(tx.get("Active_Loans", 0)),
+        "Session_Time": float(tx.get("Session_Time", 0.0)),
+        "Transactions_Per_Day": features["Transactions_Per_Day"],
+        "Velocity": features["Velocity"],
+        "Large_Transaction_Flag": features["Large_Transaction_Flag"],
+        "Large_Transaction_Frequency": features["Large_Transaction_Frequency"],
+        "Merchant_Type_Code": MERCHANT_MAP.get(tx.get("Merchant_Category", ""), 0),
+        "Device_Type_Code": DEVICE_MAP.get(tx.get("Device_Type", ""), 0)
+    }
+
+def build_fallback_vector(feature_vector, payment_method_code):
+    return [
+        feature_vector["Amount"],
+        feature_vector["Active_Loan_Count"],
+        feature_vector["Session_Time"],
+        feature_vector["Transactions_Per_Day"],        # → Transactions_Per_Unit_Time
+        feature_vector["Velocity"],
+        feature_vector["Large_Transaction_Flag"],      # → High_Value_Transaction
+        feature_vector["Large_Transaction_Frequency"], # → Large_Transaction_Freq
+        payment_method_code,                           # → Payment_Method
+        feature_vector["Device_Type_Code"]             # → Device_Type
+    ]
+
+def profile_update(feature_vector):
+    """Fields written back to user:{id} after a Legit transaction"""
+    return {
+        "Avg_Amount": feature_vector["Avg_Amount"],
+        "Active_Loan_Count": feature_vector["Active_Loan_Count"],
+        "Transactions_Per_Day": feature_vector["Transactions_Per_Day"],
+        "Velocity": feature_vector["Velocity"],
+        "Large_Transaction_Frequency": feature_vector["Large_Transaction_Frequency"],
+        "Large_Transaction_Flag": feature_vector["Large_Transaction_Flag"]
+    }
+
+# ========== Categorization ==========
+def categorize(suspicion_buffers, user_id, prob, pred, fallback_used):
+    if fallback_used:
+        if pred == 0:
+            category = "🟩 Legit"
+        else:
+            category = "🟥 FRAUD"
+        suspicion_buffers[user_id].clear()
+        return category, (1.0 if pred == 1 else 0.0)
+
+    if prob <= 0.4:
+        category = "🟩 Legit"
+        suspicion_buffers[user_id].clear()
+    elif prob <= 0.8:
+        suspicion_buffers[user_id].append(prob)
+        buffer_total = sum(suspicion_buffers[user_id])
+        if buffer_total > 0.8:
+            category = "🟥 FRAUD (Buffered)"
+            suspicion_buffers[user_id].clear()
+        else:
+            category = "🟨 Suspicious"
+    else:
+        category = "🟥 FRAUD"
+        suspicion_buffers[user_id].clear()
+    return category, prob
+
+def print_result(user_id, cluster, amount, prob, category):
+    print(f"\n🚨 Transaction:")
+    print(f"   User ID         : {user_id}")
+    print(f"   Cluster         : {cluster}")
+    print(f"   Amount          : ₹{amount}")
+    print(f"   Fraud Score     : {prob:.4f}")
+    print(f"   Category        : {category}")
+
+# ========== Batch Scoring ==========
+def score_wave(registry, wave):
+    """
+    Score (tx, feature_vector) pairs from distinct users together: feature vectors
+    are grouped by cluster so each scaler/model runs once per group on a 2-D array.
+    Returns (cluster, prob, pred, fallback_used) per pair, or None if unscorable.
+    registry is a ClusterModelRegistry, or one of its ModelGenerations to pin the
+    whole wave to a generation while reloads happen on another thread.
+    """
+    results = [None] * len(wave)
+    cluster_groups = defaultdict(list)
+    fallback_rows = []
+
+    # Users the cluster mapping doesn't know yet get a cluster from the online assigner
+    registry.assign_new_users([tx["User_ID"] for tx, _ in wave])
+
+    for i, (tx, feature_vector) in enumerate(wave):
+        cluster = registry.cluster_for(tx["User_ID"])
+        if cluster is not None and registry.has_cluster(cluster):
+            cluster_groups[cluster].append(i)
+        elif registry.has_fallback:
+            # Users mapped to a cluster without a trained model reuse the merchant code
+            # as Payment_Method; unmapped users send their actual payment method
+            if cluster is not None:
+                payment_code = feature_vector["Merchant_Type_Code"]
+            else:
+                payment_code = PAYMENT_METHOD_MAP.get(tx.get("Payment_Method", "Credit Card"), 0)
+            fallback_rows.append((i, build_fallback_vector(feature_vector, payment_code)))
+        else:
+            print("⚠️ No cluster or fallback model available.")
+
+    for cluster, indices in cluster_groups.items():
+        X = np.array([list(wave[i][1].values()) for i in indices])
+        probs = registry.score(cluster, X)
+        for i, prob in zip(indices, probs):
+            results[i] = (cluster, prob, None, False)
+
+    if fallback_rows:
+        preds = registry.predict_fallback(np.array([row for _, row in fallback_rows]))
+        for (i, _), pred in zip(fallback_rows, preds):
+            results[i] = ("Fallback", None, pred, True)
+
+    return results
@@ -0,0 +1,98 @@
+import os
+import importlib.util
+import numpy as np
+import pandas as pd
+import pytest
+import trigger
+
+# ========== Feature Extraction Parity ==========
+# extract_transaction_features in trigger.py and Backend_tryout/feature_engineering.py
+# compute every per-transaction feature as a whole-column operation. These tests
+# compare them, exactly, with the original iterrows implementation below.
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+TRYOUT_FEATURES = os.path.join(BACKEND_DIR, os.pardir, "Backend_tryout", "feature_engineering.py")
+
+def load_tryout_features():
+    # Loaded by path: Backend_tryout has its own trigger.py, so it can't go on sys.path
+    spec = importlib.util.spec_from_file_location("tryout_feature_engineering", TRYOUT_FEATURES)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def extract_transaction_features_rowwise(user_data):
+    """Original row-by-row implementation"""
+    features = []
+
+    amounts = user_data['Amount'].astype(float)
+    user_avg = amounts.mean()
+
+    # Convert dates for time-based features
+    user_data = user_data.copy()
+    if 'Date' in user_data.columns:
+        user_data['Date'] = pd.to_datetime(user_data['Date'])
+        user_data = user_data.sort_values('Date')
+
+    for idx, row in user_data.iterrows():
+        tx_features = {}
+
+        # Amount-based features
+        tx_features['Amount'] = float(row['Amount'])
+        tx_features['Amount_Deviation'] = abs(float(row['Amount']) - user_avg)
+        tx_features['Amount_Ratio'] = float(row['Amount']) / max(user_avg, 1.0)
+
+        # Session and loan features
+        tx_features['Session_Time'] = float(row.get('Session_Time', 0))
+        tx_features['Active_Loan_Count'] = float(row.get('Active_Loan_Count', 0))
+
+        # Categorical features
+        merchant_code = trigger.MERCHANT_MAP.get(row.get('Merchant_Category', ''), 0)
+        device_code = trigger.DEVICE_MAP.get(row.get('Device_Type', ''), 0)
+        tx_features['Merchant_Type_Code'] = float(merchant_code)
+        tx_features['Device_Type_Code'] = float(device_code)
+
+        # Time-based features (if available)
+        if 'Date' in user_data.columns:
+            tx_features['Hour_Of_Day'] = float(row['Date'].hour)
+            tx_features['Day_Of_Week'] = float(row['Date'].weekday())
+        else:
+            tx_features['Hour_Of_Day'] = 12.0  # Default noon
+            tx_features['Day_Of_Week'] = 1.0   # Default Tuesday
+
+        features.append(tx_features)
+
+    return pd.DataFrame(features)
+
+def edge_case_transactions():
+    """Missing and unknown categories, NaN session times, loan counts and timestamps with times"""
+    return pd.DataFrame({
+        'User_ID': ['U1'] * 4 + ['U2'] * 3,
+        'Date': ['2024-03-02 09:15:00', '2024-03-01 23:59:59', '2024-03-05 00:00:00', '2024-03-03 12:00:00',
+                 '2024-01-01 08:00:00', '2024-01-01 08:00:00', '2023-12-31 06:30:00'],
+        'Amount': [120.5, 0.0, 9800.25, 45.0, 0.4, 0.2, 0.9],
+        'Merchant_Category': ['Travel', None, 'Spaceships', 'Groceries', 'Jewelry', '', 'Food'],
+        'Device_Type': ['PC', 'Mobile', None, 'Watch', 'Tablet', 'PC', 'Mobile'],
+        'Session_Time': [12.5, np.nan, 3.0, 7.25, 1.0, np.nan, 2.0],
+        'Active_Loan_Count': [0, 2, 1, 0, 3, 3, 1]
+    })
+
+@pytest.fixture(scope="module", params=["trigger", "feature_engineering"])
+def extract(request):
+    if request.param == "trigger":
+        return trigger.extract_transaction_features
+    return load_tryout_features().extract_transaction_features
+
+def assert_parity(extract, df):
+    for user_id, user_data in df.groupby('User_ID'):
+        pd.testing.assert_frame_equal(extract(user_data), extract_transaction_features_rowwise(user_data),
+                                      check_exact=True, obj=f"features of {user_id}")
+
+def test_matches_rowwise_on_synthetic_transactions(extract):
+    df = pd.read_csv(os.path.join(BACKEND_DIR, "synthetic_txns.csv")).dropna(subset=["User_ID", "Amount", "Date"])
+    assert_parity(extract, df)
+
+def test_matches_rowwise_on_edge_cases(extract):
+    assert_parity(extract, edge_case_transactions())
+
+def test_matches_rowwise_without_dates(extract):
+    assert_parity(extract, edge_case_transactions().drop(columns=['Date', 'Session_Time']))
@@ -1,5 +1,9 @@
 import os
+import re
 import json
+import time
+import shutil
+import argparse
 import numpy as np
 import joblib
 import pandas as pd
@@ -10,13 +14,42 @@ from sklearn.cluster import KMeans
 import umap
 import hdbscan
 from collections import defaultdict
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta
+from cluster_assigner import ClusterAssigner
+from feature_store import UserFeatureStore
+from cluster_index import write_cluster_index
+from redis_features import USER_SET_KEY, USER_SET_BACKFILLED_KEY, assignments_key, rollup_counters
 
 # ========== Constants ==========
-JSON_FILE = "user_feature_data.json"
+JSON_FILE = "user_feature_data.json"  # legacy format, imported into the feature store once
+FEATURE_STORE_DIR = "user_feature_store"
 CLUSTER_MAP_FILE = "user_cluster_mapping.json"
+CLUSTER_INDEX_FILE = "user_cluster_index.idx"
 MODEL_DIR = "cluster_models"
+MANIFEST_FILE = os.path.join(MODEL_DIR, "manifest.json")
+ASSIGNER_FILE = "cluster_assigner.pkl"
+GENERATION_DIR_FORMAT = "generation_{:06d}"
+GENERATION_DIR_PATTERN = re.compile(r"^generation_(\d+)$")
+KEEP_GENERATIONS = 2  # the published one, and the one consumers may still be swapping out
 FRAUD_CSV = "transactions.csv"
+REDIS_SYNC_BATCH_SIZE = 1000
+
+# ========== Clustering Backends ==========
+# "exact" runs UMAP + HDBSCAN on every user. "sampled" fits them on a stratified
+# sample of at most sample_size users and assigns everyone else in batches of
+# batch_size with the fitted model, on `workers` processes. Users not assigned
+# within time_budget_s seconds are left out of the mapping and get a cluster
+# online from the consumer's assigner instead.
+CLUSTERING_DEFAULTS = {
+    "mode": "exact",
+    "sample_size": 50000,
+    "batch_size": 10000,
+    "workers": 1,
+    "time_budget_s": None
+}
+UNASSIGNED = -2
 
 # ========== CRITICAL: Match consumer.py features exactly ==========
 FEATURE_KEYS = [
@@ -55,31 +88,151 @@ MERCHANT_MAP = {
 
 DEVICE_MAP = {'Mobile': 0, 'PC': 1, 'Tablet': 2}
 
+# Per-transaction columns as float arrays, shared by the per-user and batch paths
+def _float_column(df, name, default=0.0):
+    if name in df.columns:
+        return df[name].astype(float).to_numpy()
+    return np.full(len(df), float(default))
+
+def _code_column(df, name, mapping):
+    if name in df.columns:
+        return df[name].map(mapping).fillna(0).astype(float).to_numpy()
+    return np.full(len(df), float(mapping.get('', 0)))
+
 os.makedirs(MODEL_DIR, exist_ok=True)
 
 # ========== Redis ==========
 r = redis.Redis(host='localhost', port=6379, decode_responses=True)
 
-# ========== Load / Save JSON ==========
+# ========== Process Pools ==========
+def process_pool(workers, **kwargs):
+    """
+    ProcessPoolExecutor with freshly spawned workers. Forking once UMAP's numba
+    threads are running leaves the parent process hanging on exit.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), **kwargs)
+
+def map_jobs(fn, jobs, workers, *args):
+    """
+    Yield (key, result, error) for fn(value, *args) over a {key: value} dict, as
+    jobs finish. A single worker runs in-process and skips spawning a pool.
+    """
+    if workers <= 1:
+        for key, value in jobs.items():
+            try:
+                yield key, fn(value, *args), None
+            except Exception as e:
+                yield key, None, e
+        return
+    with process_pool(workers) as pool:
+        futures = {pool.submit(fn, value, *args): key for key, value in jobs.items()}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+# ========== Load / Save Data ==========
 def load_feature_data():
     if os.path.exists(JSON_FILE):
         with open(JSON_FILE, 'r') as f:
             return json.load(f)
     return {}
 
-def save_feature_data(data):
-    with open(JSON_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+def open_feature_store(force_rebuild=False):
+    """Open the columnar user feature store, importing a legacy user_feature_data.json once"""
+    store = UserFeatureStore(FEATURE_STORE_DIR, columns=USER_FEATURE_COLUMNS)
+    if force_rebuild:
+        store.clear()
+        return UserFeatureStore(FEATURE_STORE_DIR, columns=USER_FEATURE_COLUMNS)
+    if not len(store):
+        legacy = load_feature_data()
+        if legacy:
+            added, _ = store.upsert_dicts(legacy)
+            print(f"📦 Imported {added} users from {JSON_FILE} into {FEATURE_STORE_DIR}")
+    return store
 
 def load_cluster_mapping():
-    if os.path.exists(CLUSTER_MAP_FILE):
-        with open(CLUSTER_MAP_FILE, 'r') as f:
+    """The published generation's cluster mapping (or a pre-generation user_cluster_mapping.json)"""
+    manifest = load_model_manifest()
+    path = os.path.join(MODEL_DIR, manifest["cluster_map_file"]) if "directory" in manifest else CLUSTER_MAP_FILE
+    if os.path.exists(path):
+        with open(path, 'r') as f:
             return json.load(f)
     return {}
 
-def save_cluster_mapping(mapping):
-    with open(CLUSTER_MAP_FILE, 'w') as f:
+# ========== Model Generations ==========
+# Every retrain writes its bundles, assigner, cluster mapping and index into a
+# fresh cluster_models/generation_NNNNNN directory that nothing reads yet.
+# Replacing manifest.json, which names those files, is the only commit point:
+# a consumer starting or reloading mid-retrain sees either the old generation
+# or the new one, never a mix of the two.
+def load_model_manifest():
+    if os.path.exists(MANIFEST_FILE):
+        with open(MANIFEST_FILE, 'r') as f:
+            return json.load(f)
+    return {}
+
+def start_model_generation():
+    """Create an empty directory for the next generation. Returns (generation, directory name)."""
+    generation = load_model_manifest().get("generation", 0) + 1
+    directory = GENERATION_DIR_FORMAT.format(generation)
+    path = os.path.join(MODEL_DIR, directory)
+    shutil.rmtree(path, ignore_errors=True)  # left over from a run that died before publishing
+    os.makedirs(path)
+    return generation, directory
+
+def save_model_bundle(bundle, cluster_id, directory):
+    file = os.path.join(directory, f"cluster_{cluster_id}_bundle.pkl")
+    joblib.dump(bundle, os.path.join(MODEL_DIR, file))
+    return file
+
+def save_cluster_assigner(assigner, directory):
+    file = os.path.join(directory, ASSIGNER_FILE)
+    joblib.dump(assigner, os.path.join(MODEL_DIR, file))
+    return file
+
+def save_cluster_mapping(mapping, directory):
+    """Write the mapping JSON and its memory-mapped index. Returns both file names."""
+    map_file = os.path.join(directory, CLUSTER_MAP_FILE)
+    index_file = os.path.join(directory, CLUSTER_INDEX_FILE)
+    with open(os.path.join(MODEL_DIR, map_file), 'w') as f:
         json.dump(mapping, f, indent=4)
+    # Compact memory-mapped copy the consumers look users up in
+    write_cluster_index(os.path.join(MODEL_DIR, index_file), mapping)
+    return map_file, index_file
+
+def publish_model_generation(generation, directory, bundle_files, map_file, index_file, assigner_file=None):
+    """
+    Atomically replace the manifest once every file of the generation is on disk.
+    Consumers watch this file and hot-swap to the new generation when it changes.
+    bundle_files maps cluster id → file; all file names are relative to MODEL_DIR.
+    """
+    manifest = {
+        "generation": generation,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "directory": directory,
+        "clusters": [int(c) for c in bundle_files],
+        "bundles": {str(c): file for c, file in bundle_files.items()},
+        "cluster_map_file": map_file,
+        "cluster_index": index_file
+    }
+    if assigner_file:
+        manifest["assigner"] = assigner_file
+    tmp_path = f"{MANIFEST_FILE}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, MANIFEST_FILE)
+    prune_model_generations(generation)
+    return generation
+
+def prune_model_generations(generation, keep=KEEP_GENERATIONS):
+    """Delete generation directories older than the last `keep` published ones, and their online assignments"""
+    for name in os.listdir(MODEL_DIR):
+        match = GENERATION_DIR_PATTERN.match(name)
+        if match and int(match.group(1)) <= generation - keep:
+            shutil.rmtree(os.path.join(MODEL_DIR, name), ignore_errors=True)
+            r.delete(assignments_key(int(match.group(1))))
 
 # ========== NEW: Trimmed K-Means Aggregation ==========
 def trimmed_kmeans_aggregation(user_data, trim_percent=0.15):
@@ -138,46 +291,43 @@ def trimmed_kmeans_aggregation(user_data, trim_percent=0.15):
         return fallback_simple_aggregation(user_data)
 
 def extract_transaction_features(user_data):
-    """Extract features for each individual transaction"""
-    features = []
-    
+    """Extract features for each individual transaction (whole-column operations)"""
+    if len(user_data) == 0:
+        return pd.DataFrame()
+
     amounts = user_data['Amount'].astype(float)
     user_avg = amounts.mean()
-    
+
     # Convert dates for time-based features
     user_data = user_data.copy()
     if 'Date' in user_data.columns:
         user_data['Date'] = pd.to_datetime(user_data['Date'])
         user_data = user_data.sort_values('Date')
-    
-    for idx, row in user_data.iterrows():
-        tx_features = {}
-        
+
+    amount = user_data['Amount'].astype(float).to_numpy()
+    n_rows = len(amount)
+
+    features = {
         # Amount-based features
-        tx_features['Amount'] = float(row['Amount'])
-        tx_features['Amount_Deviation'] = abs(float(row['Amount']) - user_avg)
-        tx_features['Amount_Ratio'] = float(row['Amount']) / max(user_avg, 1.0)
-        
+        'Amount': amount,
+        'Amount_Deviation': np.abs(amount - user_avg),
+        'Amount_Ratio': amount / max(user_avg, 1.0),
         # Session and loan features
-        tx_features['Session_Time'] = float(row.get('Session_Time', 0))
-        tx_features['Active_Loan_Count'] = float(row.get('Active_Loan_Count', 0))
-        
+        'Session_Time': _float_column(user_data, 'Session_Time'),
+        'Active_Loan_Count': _float_column(user_data, 'Active_Loan_Count'),
         # Categorical features
-        merchant_code = MERCHANT_MAP.get(row.get('Merchant_Category', ''), 0)
-        device_code = DEVICE_MAP.get(row.get('Device_Type', ''), 0)
-        tx_features['Merchant_Type_Code'] = float(merchant_code)
-        tx_features['Device_Type_Code'] = float(device_code)
-        
-        # Time-based features (if available)
-        if 'Date' in user_data.columns:
-            tx_features['Hour_Of_Day'] = float(row['Date'].hour)
-            tx_features['Day_Of_Week'] = float(row['Date'].weekday())
-        else:
-            tx_features['Hour_Of_Day'] = 12.0  # Default noon
-            tx_features['Day_Of_Week'] = 1.0   # Default Tuesday
-        
-        features.append(tx_features)
-    
+        'Merchant_Type_Code': _code_column(user_data, 'Merchant_Category', MERCHANT_MAP),
+        'Device_Type_Code': _code_column(user_data, 'Device_Type', DEVICE_MAP)
+    }
+
+    # Time-based features (if available)
+    if 'Date' in user_data.columns:
+        features['Hour_Of_Day'] = user_data['Date'].dt.hour.astype(float).to_numpy()
+        features['Day_Of_Week'] = user_data['Date'].dt.weekday.astype(float).to_numpy()
+    else:
+        features['Hour_Of_Day'] = np.full(n_rows, 12.0)  # Default noon
+        features['Day_Of_Week'] = np.full(n_rows, 1.0)   # Default Tuesday
+
     return pd.DataFrame(features)
 
 def add_derived_features(centroid, all_data, normal_data, original_user_data):
@@ -272,9 +422,189 @@ def fallback_simple_aggregation(user_data):
         'Device_Type_Code': float(device_code)
     }
 
+# ========== Batch Trimmed Aggregation ==========
+# Computes the same robust centroids as trimmed_kmeans_aggregation() for every
+# user at once. Users with the same transaction count n are stacked into
+# (users, features, n) arrays, so standardization, distances, the trim and the
+# centroid mean are single NumPy operations per distinct n rather than a
+# StandardScaler + KMeans fit per user. Reductions run over the same values in
+# the same order as the per-user path, so the resulting floats are identical.
+TX_FEATURE_KEYS = [
+    'Amount', 'Amount_Deviation', 'Amount_Ratio', 'Session_Time', 'Active_Loan_Count',
+    'Merchant_Type_Code', 'Device_Type_Code', 'Hour_Of_Day', 'Day_Of_Week'
+]
+
+# Columns of the user feature store: every field the aggregations produce
+USER_FEATURE_COLUMNS = TX_FEATURE_KEYS + [k for k in FEATURE_KEYS if k not in TX_FEATURE_KEYS]
+
+def _aggregate_bucket(rows, amount, session, loans, merchant, device, hour, weekday, ns, month,
+                      trim_percent):
+    """Trimmed centroids for m users with n transactions each; rows is (m, n) in CSV order"""
+    m, n = rows.shape
+
+    # extract_transaction_features: user mean in CSV order, then rows sorted by date
+    user_avg = amount[rows].sum(axis=1) / n
+    rows = np.take_along_axis(rows, np.argsort(ns[rows], axis=1, kind='quicksort'), axis=1)
+    a = amount[rows]
+    X = np.stack([
+        a,
+        np.abs(a - user_avg[:, None]),
+        a / np.maximum(user_avg, 1.0)[:, None],
+        session[rows], loans[rows], merchant[rows], device[rows], hour[rows], weekday[rows]
+    ], axis=1)  # (m, features, n): each feature's values are contiguous, as in the per-user frame
+
+    # StandardScaler (two-pass variance, constant features keep a scale of 1)
+    new_sum = X.sum(axis=-1)
+    mean = new_sum / n
+    temp = X - mean[..., None]
+    correction = temp.sum(axis=-1)
+    temp **= 2
+    var = (temp.sum(axis=-1) - correction ** 2 / n) / n
+    eps = np.finfo(np.float64).eps
+    scale = np.sqrt(var)
+    scale[var <= n * eps * var + (n * mean * eps) ** 2] = 1.0
+    X_scaled = (X - mean[..., None]) / scale[..., None]
+
+    # KMeans with k=1 is the mean of the standardized rows
+    center = X_scaled.mean(axis=-1)
+    distances = np.sqrt(((X_scaled - center[..., None]) ** 2).sum(axis=1))
+
+    n_trim = max(1, int(n * trim_percent))
+    keep = np.argsort(distances, axis=1)[:, :-n_trim]
+    n_keep = keep.shape[1]
+    centroid = np.take_along_axis(X, keep[:, None, :], axis=2).sum(axis=-1) / n_keep
+
+    # add_derived_features
+    day_ns = 86_400 * 10**9
+    date_range = (ns[rows].max(axis=1) - ns[rows].min(axis=1)) // day_ns + 1
+    months_sorted = np.sort(month[rows], axis=1)
+    months = 1 + (np.diff(months_sorted, axis=1) != 0).sum(axis=1)
+    large_count = (a > (centroid[:, 0] * 1.5)[:, None]).sum(axis=1)
+
+    results = []
+    for i in range(m):
+        features = {key: float(centroid[i, j]) for j, key in enumerate(TX_FEATURE_KEYS)}
+        features['Avg_Amount'] = features['Amount']
+        features['Transactions_Per_Day'] = float(n_keep / max(int(date_range[i]), 1))
+        features['Velocity'] = float(n_keep / max(int(months[i]), 1))
+        features['Large_Transaction_Flag'] = float(1 if large_count[i] > 0 else 0)
+        if large_count[i] > 1:
+            features['Large_Transaction_Frequency'] = float(int(date_range[i]) / int(large_count[i]))
+        else:
+            features['Large_Transaction_Frequency'] = 30.0
+        results.append(features)
+    return results
+
+def _most_common(values):
+    """Series.mode().iloc[0] for one or two values: NaN is ignored, ties go to the smallest"""
+    present = [v for v in values if isinstance(v, str)]
+    if not present:
+        return ''
+    if len(present) == 2 and present[0] != present[1]:
+        return min(present)
+    return present[0]
+
+def _fallback_bucket(rows, amount, session, loans, merchant_raw, device_raw, ns, month):
+    """fallback_simple_aggregation() for m users with n < 3 transactions each"""
+    m, n = rows.shape
+    avg_amount = amount[rows].sum(axis=1) / n
+    session_mean = session[rows].sum(axis=1) / n
+    loan_mean = np.trunc(loans[rows]).sum(axis=1) / n  # astype(int) truncates
+    date_range = (ns[rows].max(axis=1) - ns[rows].min(axis=1)) // (86_400 * 10**9) + 1
+    months = 1 + (np.diff(np.sort(month[rows], axis=1), axis=1) != 0).sum(axis=1)
+    large = (amount[rows] > (avg_amount * 1.5)[:, None]).any(axis=1)
+
+    results = []
+    for i in range(m):
+        merchant = _most_common(merchant_raw[rows[i]]) if merchant_raw is not None else ''
+        device = _most_common(device_raw[rows[i]]) if device_raw is not None else ''
+        results.append({
+            'Amount': float(avg_amount[i]),
+            'Avg_Amount': float(avg_amount[i]),
+            'Active_Loan_Count': float(loan_mean[i]),
+            'Session_Time': float(session_mean[i]),
+            'Transactions_Per_Day': float(n / max(int(date_range[i]), 1)),
+            'Velocity': float(n / max(int(months[i]), 1)),
+            'Large_Transaction_Flag': float(1 if large[i] else 0),
+            'Large_Transaction_Frequency': 30.0,
+            'Merchant_Type_Code': float(MERCHANT_MAP.get(merchant, 0)),
+            'Device_Type_Code': float(DEVICE_MAP.get(device, 0))
+        })
+    return results
+
+def _raw_column(df, name):
+    """Object values of a categorical column, or None if absent or holding non-strings"""
+    if name not in df.columns:
+        return None
+    values = df[name].to_numpy(dtype=object)
+    return values if all(isinstance(v, str) or v != v for v in values) else False
+
+def batch_trimmed_aggregation(df, trim_percent=0.15):
+    """Trimmed K-means aggregation for every user in df, in df.groupby('User_ID') order"""
+    user_codes, user_ids = pd.factorize(df['User_ID'], sort=True)
+    try:
+        dates = pd.to_datetime(df['Date'])
+        amount = df['Amount'].astype(float).to_numpy()
+        session = _float_column(df, 'Session_Time')
+        loans = _float_column(df, 'Active_Loan_Count')
+    except (ValueError, TypeError) as e:
+        print(f"⚠️ Batch aggregation unavailable ({e}), aggregating users one by one")
+        return {user_id: trimmed_kmeans_aggregation(user_data, trim_percent)
+                for user_id, user_data in df.groupby('User_ID')}
+
+    merchant = _code_column(df, 'Merchant_Category', MERCHANT_MAP)
+    device = _code_column(df, 'Device_Type', DEVICE_MAP)
+    merchant_raw = _raw_column(df, 'Merchant_Category')
+    device_raw = _raw_column(df, 'Device_Type')
+    ns = dates.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    hour = dates.dt.hour.astype(float).to_numpy()
+    weekday = dates.dt.weekday.astype(float).to_numpy()
+    month = (dates.dt.year * 12 + dates.dt.month).to_numpy()
+
+    # Group rows by user, keeping CSV order within each user
+    order = np.argsort(user_codes, kind='stable')
+    counts = np.bincount(user_codes, minlength=len(user_ids))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    has_nan = np.bincount(user_codes, weights=np.isnan(amount) | np.isnan(session) | np.isnan(loans),
+                          minlength=len(user_ids)) > 0
+
+    results = [None] * len(user_ids)
+    few = counts < 3
+    if merchant_raw is False or device_raw is False:
+        irregular = np.flatnonzero(few | has_nan)
+    else:
+        irregular = np.flatnonzero(has_nan)
+    for code in irregular:
+        # Missing values (or unusual categories): same path as the per-user engine
+        user_rows = order[starts[code]:starts[code] + counts[code]]
+        results[code] = trimmed_kmeans_aggregation(df.iloc[user_rows], trim_percent)
+
+    regular = np.setdiff1d(np.arange(len(user_ids)), irregular)
+    for n in np.unique(counts[regular]):
+        codes = regular[counts[regular] == n]
+        rows = order[starts[codes][:, None] + np.arange(n)]
+        if n < 3:
+            bucket = _fallback_bucket(rows, amount, session, loans, merchant_raw, device_raw, ns, month)
+        else:
+            bucket = _aggregate_bucket(rows, amount, session, loans, merchant, device, hour, weekday,
+                                       ns, month, trim_percent)
+        for code, features in zip(codes, bucket):
+            results[code] = features
+
+    print(f"   Aggregated {len(regular)} users in {len(np.unique(counts[regular]))} batches, "
+          f"{len(irregular)} users individually")
+    return dict(zip(user_ids, results))
+
+def _shard_aggregation(shard, trim_percent):
+    return batch_trimmed_aggregation(shard, trim_percent)
+
 # ========== Enhanced CSV Processing with Trimmed K-Means ==========
-def process_csv_to_user_features():
-    """Process CSV data into user-level feature representations using trimmed K-means"""
+def process_csv_to_user_features(workers=1, engine="batch"):
+    """
+    Process CSV data into user-level feature representations using trimmed K-means.
+    engine="batch" aggregates all users together (sharded over `workers` processes);
+    engine="loop" fits each user separately.
+    """
     if not os.path.exists(FRAUD_CSV):
         print("❌ No fraud.csv found. Cannot bootstrap.")
         return {}
@@ -287,6 +617,25 @@ def process_csv_to_user_features():
     
     user_features = {}
     
+    if engine == "batch":
+        if workers > 1:
+            # Shard by user; every user's transactions stay in one shard
+            user_ids = np.sort(df['User_ID'].unique())
+            shards = [df[df['User_ID'].isin(ids)] for ids in np.array_split(user_ids, workers) if len(ids)]
+            with process_pool(workers) as pool:
+                for shard_features in pool.map(_shard_aggregation, shards, [0.15] * len(shards)):
+                    user_features.update(shard_features)
+        else:
+            user_features = batch_trimmed_aggregation(df, trim_percent=0.15)
+
+        for robust_features in user_features.values():
+            for key in FEATURE_KEYS:
+                if key not in robust_features:
+                    robust_features[key] = 0.0
+
+        print(f"✅ Processed {len(user_features)} users with trimmed K-means aggregation")
+        return user_features
+
     for user_id, user_data in df.groupby('User_ID'):
         try:
             print(f"🔄 Processing user {user_id} with {len(user_data)} transactions...")
@@ -308,81 +657,273 @@ def process_csv_to_user_features():
     print(f"✅ Processed {len(user_features)} users with trimmed K-means aggregation")
     return user_features
 
+# ========== Cluster Training Features ==========
+def compute_training_features(df):
+    """
+    Per-transaction FEATURE_KEYS columns used to train the cluster Isolation
+    Forests. Every feature is a per-user groupby aggregate, computed for all
+    users at once.
+    """
+    tx = df.copy()
+    tx['Amount'] = tx['Amount'].astype(float)
+    tx['Avg_Amount'] = tx.groupby('User_ID')['Amount'].transform('mean')
+    tx['Active_Loan_Count'] = tx['Active_Loan_Count'].astype(float)
+    tx['Session_Time'] = tx['Session_Time'].astype(float)
+
+    # Process merchant and device codes
+    tx['Merchant_Type_Code'] = tx['Merchant_Type'].map(MERCHANT_MAP).fillna(0)
+    tx['Device_Type_Code'] = tx['Device_Type'].map(DEVICE_MAP).fillna(0)
+
+    # Timestamp processing for time-based features
+    tx['Date'] = pd.to_datetime(tx['Date'], errors='coerce')
+    tx['Tx_Date'] = tx['Date'].dt.date
+    users = tx.groupby('User_ID')
+
+    # Average transactions per active day
+    tx_per_day = tx.groupby(['User_ID', 'Tx_Date']).size().groupby('User_ID').mean()
+    tx['Transactions_Per_Day'] = tx['User_ID'].map(tx_per_day).fillna(1.0)
+
+    # Velocity (transactions per active month)
+    months_per_user = tx.assign(Month=tx['Date'].dt.to_period('M')).groupby('User_ID')['Month'].nunique()
+    velocity = users.size() / months_per_user.replace(0, 1)
+    tx['Velocity'] = tx['User_ID'].map(velocity).fillna(1.0)
+
+    # Large transactions: above 1.5x the user's mean amount
+    large = tx['Amount'] > users['Amount'].transform('mean') * 1.5
+    large_count = large.groupby(tx['User_ID']).transform('sum')
+    tx['Large_Transaction_Flag'] = (large_count > 0).astype(float)
+
+    # Mean whole-day gap between a user's consecutive large transactions (at least 1)
+    large_tx = tx.loc[large, ['User_ID', 'Date']].sort_values(['User_ID', 'Date'])
+    gaps = large_tx.groupby('User_ID')['Date'].diff().dt.days
+    mean_gap = gaps.groupby(large_tx['User_ID']).mean().dropna().clip(lower=1.0)
+    tx['Large_Transaction_Frequency'] = tx['User_ID'].map(mean_gap).where(large_count > 1).fillna(30.0)
+
+    return tx
+
+# ========== Clustering ==========
+def fit_umap_hdbscan(feature_matrix):
+    print("🧮 Performing UMAP dimensionality reduction...")
+    reducer = umap.UMAP(n_components=2, random_state=42, n_neighbors=15, min_dist=0.1)
+    embedding = reducer.fit_transform(feature_matrix)
+
+    print("🔍 Performing HDBSCAN clustering...")
+    clusterer = hdbscan.HDBSCAN(min_cluster_size=max(10, len(feature_matrix)//20), 
+                                min_samples=5, 
+                                cluster_selection_epsilon=0.1)
+    clusters = clusterer.fit_predict(embedding)
+    return reducer, clusterer, embedding, clusters
+
+def cluster_exact(feature_matrix):
+    """UMAP + HDBSCAN over every user; returns (clusters, assigner)"""
+    reducer, clusterer, embedding, clusters = fit_umap_hdbscan(feature_matrix)
+    return clusters, ClusterAssigner(reducer, clusterer, feature_matrix, embedding, clusters)
+
+def stratified_sample(feature_matrix, sample_size, seed=42):
+    """
+    Sorted row indices of a sample of about sample_size users in which every
+    merchant type × amount quartile stratum keeps its share (and at least one user)
+    """
+    n_users = len(feature_matrix)
+    if sample_size >= n_users:
+        return np.arange(n_users)
+
+    amount = np.nan_to_num(feature_matrix[:, FEATURE_KEYS.index('Amount')])
+    merchant = np.nan_to_num(feature_matrix[:, FEATURE_KEYS.index('Merchant_Type_Code')]).astype(np.int64)
+    quartile = np.searchsorted(np.quantile(amount, [0.25, 0.5, 0.75]), amount, side='right')
+    strata = merchant * 4 + quartile
+
+    rng = np.random.default_rng(seed)
+    order = np.argsort(strata, kind='stable')
+    _, starts, counts = np.unique(strata[order], return_index=True, return_counts=True)
+    chosen = []
+    for start, count in zip(starts, counts):
+        take = min(count, max(1, int(round(count * sample_size / n_users))))
+        chosen.append(rng.choice(order[start:start + count], size=take, replace=False))
+    return np.sort(np.concatenate(chosen))
+
+_worker_assigner = None
+
+def _init_assign_worker(assigner):
+    global _worker_assigner
+    _worker_assigner = assigner
+
+def _assign_batch(rows):
+    return _worker_assigner.assign(rows)
+
+def cluster_sampled(feature_matrix, options):
+    """
+    Fit UMAP + HDBSCAN on a stratified sample, then assign the remaining users in
+    batches with the fitted model; returns (clusters, assigner). Users whose batch
+    didn't finish within options["time_budget_s"] are labelled UNASSIGNED.
+    """
+    started = time.perf_counter()
+    sample = stratified_sample(feature_matrix, options["sample_size"])
+    print(f"🎯 Fitting on a stratified sample of {len(sample)}/{len(feature_matrix)} users")
+    reducer, clusterer, embedding, sample_clusters = fit_umap_hdbscan(feature_matrix[sample])
+    assigner = ClusterAssigner(reducer, clusterer, feature_matrix[sample], embedding, sample_clusters)
+
+    clusters = np.full(len(feature_matrix), UNASSIGNED, dtype=np.int64)
+    clusters[sample] = sample_clusters
+    rest = np.setdiff1d(np.arange(len(feature_matrix)), sample)
+    batches = [rest[i:i + options["batch_size"]] for i in range(0, len(rest), options["batch_size"])]
+    deadline = started + options["time_budget_s"] if options["time_budget_s"] else None
+    print(f"🧭 Assigning {len(rest)} users in {len(batches)} batches with {options['workers']} workers")
+
+    if options["workers"] <= 1:
+        for batch in batches:
+            if deadline and time.perf_counter() > deadline:
+                break
+            clusters[batch] = assigner.assign(feature_matrix[batch])
+    else:
+        with process_pool(options["workers"], initializer=_init_assign_worker, initargs=(assigner,)) as pool:
+            # Keep one batch per worker in flight so no new batch starts after the deadline
+            queued = iter(batches)
+            running = {}
+            while True:
+                while len(running) < options["workers"] and not (deadline and time.perf_counter() > deadline):
+                    batch = next(queued, None)
+                    if batch is None:
+                        break
+                    running[pool.submit(_assign_batch, feature_matrix[batch])] = batch
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    clusters[running.pop(future)] = future.result()
+    return clusters, assigner
+
+# ========== Cluster Model Training ==========
+def training_budget(n_models, workers=None):
+    """Split the machine's cores into (worker processes, IsolationForest n_jobs per worker)"""
+    cores = os.cpu_count() or 1
+    workers = max(1, min(workers or cores, n_models or 1, cores))
+    return workers, max(1, cores // workers)
+
+def train_cluster_model(feature_matrix, n_jobs=1):
+    """Fit one cluster's scaler and Isolation Forest; returns (bundle, seconds). Runs in a worker process."""
+    started = time.perf_counter()
+
+    # Scale and train
+    scaler = MinMaxScaler()
+    X_scaled = scaler.fit_transform(feature_matrix)
+
+    model = IsolationForest(contamination=0.1, n_estimators=100, random_state=42, n_jobs=n_jobs)
+    model.fit(X_scaled)
+
+    # Get score range for normalization
+    train_scores = model.decision_function(X_scaled)
+    score_min, score_max = train_scores.min(), train_scores.max()
+
+    # Drop the worker's thread count so scoring processes don't inherit it
+    model.n_jobs = None
+    return (model, scaler, score_min, score_max), time.perf_counter() - started
+
 # ========== Enhanced Redis Integration ==========
-def update_from_redis(json_data):
-    """Update user features from Redis data"""
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def profile_user_ids(batch_size=REDIS_SYNC_BATCH_SIZE):
+    """
+    Yield the ids of users that may have a user:{id} profile hash. Uses the
+    user id set the consumers maintain once it has been backfilled; until then,
+    falls back to one SCAN over user:* that skips per-user sub-keys and backfills
+    the set, marking it complete only after the SCAN finishes.
+    """
+    if r.exists(USER_SET_BACKFILLED_KEY):
+        yield from r.sscan_iter(USER_SET_KEY, count=batch_size)
+        return
+
+    print(f"⚠️ {USER_SET_KEY} not backfilled in Redis yet, scanning user:* keys to build it")
+    found = []
+    for key in r.scan_iter("user:*", count=batch_size):
+        parts = key.split(":")
+        if len(parts) != 2:
+            continue  # user:{id}:windows:{layout}, user:{id}:history and legacy per-period counters
+        found.append(parts[1])
+        yield parts[1]
+        if len(found) >= batch_size:
+            r.sadd(USER_SET_KEY, *found)
+            found = []
+    if found:
+        r.sadd(USER_SET_KEY, *found)
+    r.set(USER_SET_BACKFILLED_KEY, 1)
+
+def update_from_redis(store, batch_size=REDIS_SYNC_BATCH_SIZE):
+    """Update user features in the feature store from Redis profiles, fetched in pipelined batches"""
     print("🔄 Syncing from Redis...")
-    new_count = 0
-    updated_count = 0
-    
-    for key in r.scan_iter("user:*"):
-        if ":tx:" in key or ":velocity:" in key:
-            continue
-            
-        user_id = key.split(":")[1]
-        user_hash = r.hgetall(key)
-        
-        if not user_hash:
-            continue
-            
-        # Create feature vector from Redis data
-        try:
-            redis_features = {}
-            for feature_key in FEATURE_KEYS:
-                if feature_key in ['Merchant_Type_Code', 'Device_Type_Code']:
-                    # These should be encoded values already in Redis
-                    redis_features[feature_key] = float(user_hash.get(feature_key, 0.0))
-                else:
-                    redis_features[feature_key] = float(user_hash.get(feature_key, 0.0))
-            
-            if user_id not in json_data:
-                new_count += 1
-                json_data[user_id] = redis_features
-            else:
-                # Update existing user data
-                json_data[user_id].update(redis_features)
-                updated_count += 1
-                
-        except Exception as e:
-            print(f"⚠️ Error processing Redis data for user {user_id}: {e}")
-            continue
+    started = time.perf_counter()
+    user_ids = []
+    rows = []
+    missing = []
+
+    for batch in batched(profile_user_ids(batch_size), batch_size):
+        # One round trip per batch: whether the profile exists, and its feature fields
+        pipe = r.pipeline(transaction=False)
+        for batch_user in batch:
+            pipe.hlen(f"user:{batch_user}")
+            pipe.hmget(f"user:{batch_user}", FEATURE_KEYS)
+        replies = pipe.execute()
+
+        for batch_user, field_count, values in zip(batch, replies[::2], replies[1::2]):
+            if not field_count:
+                missing.append(batch_user)
+                continue
+            try:
+                rows.append([float(v) if v is not None else 0.0 for v in values])
+                user_ids.append(batch_user)
+            except Exception as e:
+                print(f"⚠️ Error processing Redis data for user {batch_user}: {e}")
 
-    print(f"✅ Added {new_count} new users, updated {updated_count} users from Redis")
-    return json_data
+    if missing:
+        r.srem(USER_SET_KEY, *missing)  # ids whose profile no longer exists
+
+    # Only new users and users whose features changed are written
+    new_count, updated_count = store.upsert(user_ids, rows, columns=FEATURE_KEYS)
+    print(f"✅ Added {new_count} new users, updated {updated_count} changed users "
+          f"of {len(user_ids)} from Redis in {time.perf_counter() - started:.2f}s")
+    return store
+
+def rollup_redis_counters(batch_size=REDIS_SYNC_BATCH_SIZE):
+    """Compact legacy per-day and per-month counters into user summaries"""
+    print("🗜️ Rolling up old Redis counters...")
+    started = time.perf_counter()
+    rolled = rollup_counters(r, batch_size=batch_size)
+    print(f"✅ Rolled up {rolled['day']} daily and {rolled['month']} monthly counters, "
+          f"left {rolled['live']} still in use, in {time.perf_counter() - started:.2f}s")
+    return rolled
 
 # ========== FIXED: Clustering + Model Training ==========
-def generate_user_cluster_hashmap():
+def generate_user_cluster_hashmap(force_rebuild=False, feature_workers=1, train_workers=None, clustering=None):
     print("🔁 Starting comprehensive clustering and training...")
 
     # Step 1: Load existing data or process CSV
-    json_data = load_feature_data()
-    if not json_data:
-        json_data = process_csv_to_user_features()
-        if json_data:
-            save_feature_data(json_data)
+    store = open_feature_store(force_rebuild)
+    if not len(store):
+        user_features = process_csv_to_user_features(workers=feature_workers)
+        if user_features:
+            store.upsert_dicts(user_features)
 
     # Step 2: Update from Redis
-    if json_data:
-        json_data = update_from_redis(json_data)
-        save_feature_data(json_data)
+    if len(store):
+        update_from_redis(store)
     
-    if not json_data:
+    if not len(store):
         print("❌ No data available for clustering.")
         return {}
 
-    print(f"📊 Total users for clustering: {len(json_data)}")
+    print(f"📊 Total users for clustering: {len(store)}")
 
-    # Step 3: Prepare feature matrix
-    user_ids = list(json_data.keys())
-    feature_matrix = []
-    
-    for user_id in user_ids:
-        user_features = json_data[user_id]
-        # Ensure all 10 features are present in correct order
-        feature_row = [user_features.get(key, 0.0) for key in FEATURE_KEYS]
-        feature_matrix.append(feature_row)
-    
-    feature_matrix = np.array(feature_matrix)
+    # Step 3: Prepare feature matrix (all 10 features in FEATURE_KEYS order, straight from the store)
+    user_ids = store.user_id_list()
+    feature_matrix = store.matrix(FEATURE_KEYS).astype(np.float64)
     print(f"📈 Feature matrix shape: {feature_matrix.shape}")
     
     # Validate feature matrix
@@ -390,16 +931,47 @@ def generate_user_cluster_hashmap():
         print(f"❌ Feature matrix has {feature_matrix.shape[1]} features, expected 10")
         return {}
 
+    # Per-transaction training features only depend on the user's own transactions,
+    # so they are computed once here rather than per cluster after clustering
+    print("📂 Loading all transactions for cluster-level training...")
+    df = pd.read_csv(FRAUD_CSV)
+    df = df.dropna(subset=["User_ID", "Amount", "Date"])
+    print("📋 Columns in full dataframe:", df.columns.tolist())
+    try:
+        started = time.perf_counter()
+        tx_features = compute_training_features(df)
+        print(f"🔧 Computed training features for {len(tx_features)} transactions "
+              f"in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        print(f"❌ Error computing training features, no cluster models will be trained: {e}")
+        tx_features = None
+
     # Step 4: UMAP + HDBSCAN Clustering
-    print("🧮 Performing UMAP dimensionality reduction...")
-    reducer = umap.UMAP(n_components=2, random_state=42, n_neighbors=15, min_dist=0.1)
-    embedding = reducer.fit_transform(feature_matrix)
+    clustering = {**CLUSTERING_DEFAULTS, **(clustering or {})}
+    started = time.perf_counter()
+    if clustering["mode"] == "sampled":
+        clusters, assigner = cluster_sampled(feature_matrix, clustering)
+    elif clustering["mode"] == "exact":
+        clusters, assigner = cluster_exact(feature_matrix)
+    else:
+        raise ValueError(f"Unknown clustering mode {clustering['mode']!r}")
+    print(f"⏱️ {clustering['mode'].capitalize()} clustering took {time.perf_counter() - started:.2f}s")
 
-    print("🔍 Performing HDBSCAN clustering...")
-    clusterer = hdbscan.HDBSCAN(min_cluster_size=max(10, len(user_ids)//20), 
-                                min_samples=5, 
-                                cluster_selection_epsilon=0.1)
-    clusters = clusterer.fit_predict(embedding)
+    # Everything this run writes goes into its own generation directory
+    generation, generation_dir = start_model_generation()
+
+    # Keep the fitted reducer and clusterer so consumers can place new users online. The
+    # pickled UMAP holds its whole training graph and data, and every consumer worker
+    # loads it, so it is only published when fitted on at most sample_size users
+    assigner_file = None
+    if assigner.fitted_rows > clustering["sample_size"]:
+        print(f"⚠️ Not publishing a cluster assigner fitted on {assigner.fitted_rows} users (over --sample-size "
+              f"{clustering['sample_size']}); use --clustering sampled for online assignment")
+    else:
+        try:
+            assigner_file = save_cluster_assigner(assigner, generation_dir)
+        except Exception as e:
+            print(f"⚠️ Could not save cluster assigner, new users will use the fallback model: {e}")
 
     # Step 5: Create cluster mapping and group data
     cluster_map = {}
@@ -407,6 +979,8 @@ def generate_user_cluster_hashmap():
     cluster_stats = defaultdict(int)
 
     for i, user_id in enumerate(user_ids):
+        if clusters[i] == UNASSIGNED:
+            continue
         cluster = int(clusters[i]) if clusters[i] >= 0 else -1
         cluster_map[user_id] = {"Cluster": cluster}
         cluster_data[cluster].append(feature_matrix[i])
@@ -416,124 +990,58 @@ def generate_user_cluster_hashmap():
     for cluster_id, count in sorted(cluster_stats.items()):
         noise_label = " (Noise)" if cluster_id == -1 else ""
         print(f"   Cluster {cluster_id}{noise_label}: {count} users")
+    unassigned = int(np.sum(clusters == UNASSIGNED))
+    if unassigned:
+        print(f"   ⏳ {unassigned} users not assigned within the time budget, left to online assignment")
 
     # Step 6: FIXED - Train Isolation Forest models using all transactions per cluster
-    print("📂 Loading all transactions for cluster-level training...")
-    df = pd.read_csv(FRAUD_CSV)
-    df = df.dropna(subset=["User_ID", "Amount", "Date"])
-    trained_clusters = 0
-    print("📋 Columns in full dataframe:", df.columns.tolist())
-
-    for cluster_id, _ in cluster_data.items():
-        if cluster_id == -1:
-            continue
-
-        cluster_users = [uid for uid, meta in cluster_map.items() if meta['Cluster'] == cluster_id]
-        cluster_df = df[df['User_ID'].isin(cluster_users)].copy()
-        
-        if len(cluster_df) < 10:
-            print(f"⚠️ Cluster {cluster_id} has only {len(cluster_df)} transactions, skipping.")
-            continue
-
-        try:
-            # Extract and process basic features
-            cluster_df['Amount'] = cluster_df['Amount'].astype(float)
-            cluster_df['Avg_Amount'] = cluster_df.groupby('User_ID')['Amount'].transform('mean')
-            cluster_df['Active_Loan_Count'] = cluster_df['Active_Loan_Count'].astype(float)
-            cluster_df['Session_Time'] = cluster_df['Session_Time'].astype(float)
-
-            # Process merchant and device codes
-            cluster_df['Merchant_Type_Code'] = cluster_df['Merchant_Type'].map(MERCHANT_MAP).fillna(0)
-            cluster_df['Device_Type_Code'] = cluster_df['Device_Type'].map(DEVICE_MAP).fillna(0)
-
-            # Timestamp processing for time-based features
-            cluster_df['Date'] = pd.to_datetime(cluster_df['Date'], errors='coerce')
-            cluster_df['Tx_Date'] = cluster_df['Date'].dt.date
-            
-            # Calculate transactions per day per user
-            tx_per_day = cluster_df.groupby(['User_ID', 'Tx_Date']).size().groupby('User_ID').mean()
-            cluster_df['Transactions_Per_Day'] = cluster_df['User_ID'].map(tx_per_day).fillna(1.0)
-
-            # Calculate velocity (transactions per month)
-            months_per_user = cluster_df.groupby('User_ID')['Date'].apply(lambda x: x.dt.to_period('M').nunique())
-            velocity = cluster_df.groupby('User_ID').size() / months_per_user.replace(0, 1)
-            cluster_df['Velocity'] = cluster_df['User_ID'].map(velocity).fillna(1.0)
-
-            # FIXED: Calculate large transaction features properly
-            print(f"🔧 Computing large transaction features for cluster {cluster_id}...")
-            
-            # Initialize with default values
-            cluster_df['Large_Transaction_Flag'] = 0.0
-            cluster_df['Large_Transaction_Frequency'] = 30.0
-            
-            # Calculate for each user separately
-            for user_id in cluster_df['User_ID'].unique():
-                user_mask = cluster_df['User_ID'] == user_id
-                user_amounts = cluster_df.loc[user_mask, 'Amount']
-                
-                if len(user_amounts) > 0:
-                    avg_amt = user_amounts.mean()
-                    large_threshold = avg_amt * 1.5
-                    large_txns = user_amounts[user_amounts > large_threshold]
-                    
-                    # Set flag
-                    flag = 1.0 if len(large_txns) > 0 else 0.0
-                    cluster_df.loc[user_mask, 'Large_Transaction_Flag'] = flag
-                    
-                    # Calculate frequency
-                    if len(large_txns) > 1:
-                        user_dates = cluster_df.loc[user_mask, 'Date'].sort_values()
-                        large_dates = cluster_df.loc[user_mask & (cluster_df['Amount'] > large_threshold), 'Date']
-                        if len(large_dates) > 1:
-                            date_diffs = large_dates.sort_values().diff().dt.days.dropna()
-                            if len(date_diffs) > 0:
-                                avg_freq = date_diffs.mean()
-                                cluster_df.loc[user_mask, 'Large_Transaction_Frequency'] = max(avg_freq, 1.0)
-
-            # Verify all required features are present
-            missing_features = [f for f in FEATURE_KEYS if f not in cluster_df.columns]
-            if missing_features:
-                print(f"⚠️ Missing features for cluster {cluster_id}: {missing_features}")
+    jobs = {}
+    if tx_features is not None:
+        # Partition transactions by cluster once instead of filtering the frame per cluster
+        user_cluster = pd.Series({uid: meta['Cluster'] for uid, meta in cluster_map.items()})
+        tx_clusters = tx_features['User_ID'].map(user_cluster)
+        for cluster_id, cluster_df in tx_features.groupby(tx_clusters, sort=False):
+            cluster_id = int(cluster_id)
+            if cluster_id == -1:
                 continue
+            if len(cluster_df) < 10:
+                print(f"⚠️ Cluster {cluster_id} has only {len(cluster_df)} transactions, skipping.")
+                continue
+            jobs[cluster_id] = cluster_df[FEATURE_KEYS].fillna(0).values
 
-            # Build feature matrix
-            feature_matrix_cluster = cluster_df[FEATURE_KEYS].fillna(0).values
-            print(f"📊 Feature matrix for cluster {cluster_id}: shape {feature_matrix_cluster.shape}")
-
-            # Scale and train
-            scaler = MinMaxScaler()
-            X_scaled = scaler.fit_transform(feature_matrix_cluster)
-
-            model = IsolationForest(contamination=0.1, n_estimators=100, random_state=42)
-            model.fit(X_scaled)
-
-            # Get score range for normalization
-            train_scores = model.decision_function(X_scaled)
-            score_min, score_max = train_scores.min(), train_scores.max()
-            
-            # Save everything as one bundle
-            bundle = (model, scaler, score_min, score_max)
-            joblib.dump(bundle, f"{MODEL_DIR}/cluster_{cluster_id}_bundle.pkl")
-
-            trained_clusters += 1
-            print(f"✅ Trained Isolation Forest for Cluster {cluster_id} on {len(X_scaled)} transactions")
-
-        except Exception as e:
-            print(f"❌ Error training model for cluster {cluster_id}: {e}")
-            import traceback
-            traceback.print_exc()
+    workers, n_jobs = training_budget(len(jobs), train_workers)
+    print(f"🤖 Training {len(jobs)} cluster models with {workers} workers x {n_jobs} threads each")
+    started = time.perf_counter()
+    results = {}
+    for cluster_id, result, error in map_jobs(train_cluster_model, jobs, workers, n_jobs):
+        if error is not None:
+            print(f"❌ Error training model for cluster {cluster_id}: {error}")
             continue
+        results[cluster_id] = result
+        print(f"✅ Trained Isolation Forest for Cluster {cluster_id} on {len(jobs[cluster_id])} "
+              f"transactions in {result[1]:.2f}s")
 
-    # Step 7: Save cluster mapping
-    save_cluster_mapping(cluster_map)
+    # Save in clustering order so the manifest lists clusters the same way every run
+    bundle_files = {}
+    for cluster_id in cluster_data:
+        if cluster_id in results:
+            bundle_files[cluster_id] = save_model_bundle(results[cluster_id][0], cluster_id, generation_dir)
+    trained_clusters = len(bundle_files)
+    print(f"⏱️ Trained {trained_clusters} cluster models in {time.perf_counter() - started:.2f}s "
+          f"(sum of per-cluster times {sum(r[1] for r in results.values()):.2f}s)")
+
+    # Step 7: Save cluster mapping and publish the new model generation
+    map_file, index_file = save_cluster_mapping(cluster_map, generation_dir)
+    publish_model_generation(generation, generation_dir, bundle_files, map_file, index_file, assigner_file)
     
     print(f"""
 🏁 Clustering and Training Complete!
    📊 Total Users: {len(user_ids)}
    🎯 Clusters Found: {len([c for c in cluster_stats.keys() if c != -1])}
    🤖 Models Trained: {trained_clusters}
-   📁 Cluster mapping saved to: {CLUSTER_MAP_FILE}
-   💾 User features saved to: {JSON_FILE}
+   🏷️ Model Generation: {generation}
+   📁 Cluster mapping saved to: {os.path.join(MODEL_DIR, map_file)}
+   💾 User features saved to: {FEATURE_STORE_DIR}
    🔧 Used Trimmed K-Means for robust aggregation
     """)
 
@@ -550,7 +1058,49 @@ def quick_load_cluster_mapping():
         print("⚠️ No existing cluster mapping found, running full clustering...")
         return generate_user_cluster_hashmap()
 
+# ========== Retraining CLI ==========
+def parse_args():
+    parser = argparse.ArgumentParser(description="Recluster users and retrain per-cluster models")
+    parser.add_argument("--force-retrain", action="store_true",
+                        help="Rebuild user features from the CSV instead of the cached JSON")
+    parser.add_argument("--interval", type=float, default=0,
+                        help="Retrain every N minutes instead of once (0 = run once)")
+    parser.add_argument("--feature-workers", type=int, default=1,
+                        help="Processes used to aggregate CSV transactions into user features")
+    parser.add_argument("--train-workers", type=int, default=None,
+                        help="Processes used to train cluster models (default: one per core)")
+    parser.add_argument("--clustering", choices=("exact", "sampled"), default=CLUSTERING_DEFAULTS["mode"],
+                        help="exact: UMAP + HDBSCAN on all users; sampled: fit on a sample, assign the rest")
+    parser.add_argument("--sample-size", type=int, default=CLUSTERING_DEFAULTS["sample_size"],
+                        help="Users the sampled mode fits UMAP + HDBSCAN on")
+    parser.add_argument("--assign-batch-size", type=int, default=CLUSTERING_DEFAULTS["batch_size"],
+                        help="Users per assignment batch in sampled mode (bounds peak memory)")
+    parser.add_argument("--cluster-workers", type=int, default=CLUSTERING_DEFAULTS["workers"],
+                        help="Processes assigning batches in sampled mode")
+    parser.add_argument("--cluster-time-budget", type=float, default=None,
+                        help="Seconds sampled mode may spend before leaving users to online assignment")
+    parser.add_argument("--rollup-counters", action="store_true",
+                        help="Compact legacy per-day/per-month Redis counters into user:{id}:history before each run")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    # For testing
-    result = generate_user_cluster_hashmap()
-    print(f"Generated cluster mapping for {len(result)} users")
\ No newline at end of file
+    args = parse_args()
+    while True:
+        started = time.perf_counter()
+        if args.rollup_counters:
+            rollup_redis_counters()
+        result = generate_user_cluster_hashmap(force_rebuild=args.force_retrain,
+                                               feature_workers=args.feature_workers,
+                                               train_workers=args.train_workers,
+                                               clustering={
+                                                   "mode": args.clustering,
+                                                   "sample_size": args.sample_size,
+                                                   "batch_size": args.assign_batch_size,
+                                                   "workers": args.cluster_workers,
+                                                   "time_budget_s": args.cluster_time_budget
+                                               })
+        print(f"Generated cluster mapping for {len(result)} users in {time.perf_counter() - started:.1f}s")
+        if args.interval <= 0:
+            break
+        print(f"⏰ Next retrain in {args.interval:g} minutes")
+        time.sleep(args.interval * 60)
\ No newline at end of file
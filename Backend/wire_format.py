@@ -0,0 +1,68 @@
+import ast
+
+# ========== Transaction Wire Format ==========
+# v2 entries are flat Redis stream fields: {"v": "2", "User_ID": "U000001", "Amount": "12.5", ...}.
+# Every value travels as a string and is converted back using TRANSACTION_FIELDS.
+# Legacy v1 entries are {"data": str(dict)} and are still accepted by decode_transaction.
+SCHEMA_VERSION = "2"
+VERSION_FIELD = "v"
+
+TRANSACTION_FIELDS = {
+    "Transaction_ID": str,
+    "User_ID": str,
+    "Date": str,
+    "Time": str,
+    "Amount": float,
+    "Merchant_Category": str,
+    "Device_Type": str,
+    "Active_Loans": int,
+    "Session_Time": float,
+    "Payment_Method": str
+}
+REQUIRED_FIELDS = ("User_ID", "Date", "Time", "Amount")
+
+class MalformedMessage(ValueError):
+    """Raised when a stream entry cannot be decoded into a transaction"""
+
+def encode_transaction(tx):
+    """Flatten a transaction dict into v2 stream fields"""
+    fields = {VERSION_FIELD: SCHEMA_VERSION}
+    for key, value in tx.items():
+        if value is not None:
+            fields[key] = str(value)
+    return fields
+
+def _decode_legacy(msg_data):
+    data_str = msg_data["data"]
+    if data_str.startswith("'") and data_str.endswith("'"):
+        data_str = data_str[1:-1]
+    try:
+        tx = ast.literal_eval(data_str)
+    except (ValueError, SyntaxError) as e:
+        raise MalformedMessage(f"unparseable legacy payload: {e}")
+    if not isinstance(tx, dict):
+        raise MalformedMessage("legacy payload is not a dictionary")
+    return tx
+
+def decode_transaction(msg_data):
+    """Decode a v2 or legacy stream entry into a typed transaction dict"""
+    version = msg_data.get(VERSION_FIELD)
+    if version == SCHEMA_VERSION:
+        tx = {k: v for k, v in msg_data.items() if k != VERSION_FIELD}
+    elif version is None and "data" in msg_data:
+        tx = _decode_legacy(msg_data)
+    else:
+        raise MalformedMessage(f"unsupported message version {version!r}")
+
+    for key in REQUIRED_FIELDS:
+        if tx.get(key) in (None, ""):
+            raise MalformedMessage(f"missing {key}")
+
+    for key, value in tx.items():
+        field_type = TRANSACTION_FIELDS.get(key)
+        if field_type is not None and value is not None and not isinstance(value, field_type):
+            try:
+                tx[key] = field_type(value)
+            except (TypeError, ValueError):
+                raise MalformedMessage(f"invalid {key}: {value!r}")
+    return tx
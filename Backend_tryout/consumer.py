@@ -6,12 +6,25 @@ import os
 import numpy as np
 import pymongo
 import secrets
+import argparse
 from datetime import datetime, timedelta
 from trigger import generate_user_cluster_hashmap
 from sklearn.preprocessing import StandardScaler
 from collections import defaultdict
 import feature_engineering
 
+# ========== CLI ==========
+parser = argparse.ArgumentParser(description="Fraud scoring consumer")
+parser.add_argument("--scorer", choices=["sklearn", "onnx"], default="sklearn",
+                    help="Score with the joblib models, or with ONNX Runtime sessions from onnx_models/")
+parser.add_argument("--onnx-threads", type=int, default=1,
+                    help="Intra-op threads per ONNX session (0 = one per core)")
+parser.add_argument("--onnx-max-sessions", type=int, default=64,
+                    help="Max ONNX sessions kept in memory (least recently used are dropped)")
+parser.add_argument("--onnx-warm", type=int, default=4,
+                    help="Load the ONNX sessions of this many most-populated clusters at startup")
+args = parser.parse_args()
+
 # ========== MongoDB Setup ==========
 mongo_client = pymongo.MongoClient("mongodb://localhost:27017/")
 db = mongo_client["RedisTransactions"]
@@ -53,6 +66,13 @@ print("🔁 Triggering cluster re-training...")
 user_cluster_map = generate_user_cluster_hashmap()
 print(f"✅ Cluster mapping loaded for {len(user_cluster_map)} users.")
 
+# ========== Cluster Models ==========
+cluster_bundles = {}
+for file in os.listdir("cluster_models"):
+    if file.startswith("cluster_") and file.endswith("_bundle.pkl"):
+        cluster_bundles[int(file.split("_")[1])] = joblib.load(os.path.join("cluster_models", file))
+print(f"✅ Loaded {len(cluster_bundles)} cluster models")
+
 # ========== Fallback Model ==========
 try:
     fallback_model = joblib.load("cluster_models/fallback_xgboost_model.joblib")
@@ -61,6 +81,77 @@ try:
 except FileNotFoundError:
     print("❌ Fallback model or scaler not found.")
     fallback_model = None
+    fallback_scaler = None
+
+# ========== ONNX Sessions ==========
+# Scalers run in NumPy. Sessions are created on first use, and a cluster's
+# session is only used once it has matched its sklearn model (a stale export
+# from an older retrain fails the check and stays on sklearn).
+onnx_manager = None
+onnx_scalers = {}  # cluster id → NumpyScaler, or None if the cluster stays on sklearn
+onnx_fallback_scaler = None
+if args.scorer == "onnx":
+    from collections import Counter
+    from onnx_inferencer import (ONNXModelManager, NumpyScaler,
+                                 check_isolation_forest_parity, check_classifier_parity)
+    onnx_manager = ONNXModelManager("onnx_models", intra_op_threads=args.onnx_threads,
+                                    max_sessions=args.onnx_max_sessions)
+    print(f"✅ ONNX Runtime providers: {onnx_manager.providers}")
+
+    if fallback_model is not None and onnx_manager.has_model("fallback_model"):
+        ok, mismatches = check_classifier_parity(onnx_manager, "fallback_model", fallback_model,
+                                                 fallback_scaler.n_features_in_)
+        if ok:
+            onnx_fallback_scaler = NumpyScaler(fallback_scaler)
+        else:
+            print(f"⚠️ ONNX fallback model disagrees with XGBoost on {mismatches} probe rows, using XGBoost")
+
+def onnx_scaler_for(cluster):
+    """Verify a cluster's ONNX session the first time it is needed; None means use sklearn"""
+    if cluster not in onnx_scalers:
+        model, scaler, _, _ = cluster_bundles[cluster]
+        name = f"cluster_{cluster}"
+        onnx_scalers[cluster] = None
+        if not onnx_manager.has_model(name):
+            print(f"⚠️ No ONNX export for {name}, scoring it with sklearn")
+        else:
+            ok, diff = check_isolation_forest_parity(onnx_manager, name, model)
+            if ok:
+                onnx_scalers[cluster] = NumpyScaler(scaler)
+            else:
+                print(f"⚠️ ONNX {name} differs from sklearn by {diff:.2e}, scoring it with sklearn")
+    return onnx_scalers[cluster]
+
+if onnx_manager is not None:
+    # Warm the clusters most users map to so their first transactions skip session creation
+    cluster_sizes = Counter(info["Cluster"] for info in user_cluster_map.values() if info["Cluster"] in cluster_bundles)
+    hottest = [c for c, _ in cluster_sizes.most_common(args.onnx_warm)]
+    verified = [c for c in hottest if onnx_scaler_for(c) is not None]
+    onnx_manager.warm_up([f"cluster_{c}" for c in verified])
+    print(f"✅ ONNX sessions warmed for clusters {verified}, "
+          f"fallback: {'ONNX' if onnx_fallback_scaler else 'XGBoost'}, {onnx_manager.stats()}")
+
+def score_cluster(cluster, X_ordered):
+    model, scaler, score_min, score_max = cluster_bundles[cluster]
+    onnx_scaler = onnx_scaler_for(cluster) if onnx_manager is not None else None
+    if onnx_scaler is not None:
+        X_scaled = onnx_scaler.transform(X_ordered)
+        score = float(onnx_manager.predict_many(f"cluster_{cluster}", X_scaled, output_name="scores")[0][0])
+    else:
+        X_scaled = scaler.transform(X_ordered)
+        score = model.decision_function(X_scaled)[0]
+
+    # Normalize using actual training score range
+    if score_max != score_min:
+        return (score - score_min) / (score_max - score_min)
+    return 0.5  # fallback if all training scores were same
+
+def predict_fallback(fallback_vector):
+    if onnx_fallback_scaler is not None:
+        X_scaled = onnx_fallback_scaler.transform(fallback_vector)
+        return int(onnx_manager.predict_many("fallback_model", X_scaled)[0])
+    X_scaled = fallback_scaler.transform(fallback_vector)
+    return fallback_model.predict(X_scaled)[0]
 
 # ========== Suspicion Buffers ==========
 suspicion_buffers = defaultdict(list)
@@ -177,43 +268,22 @@ while True:
 
                         # ------------------ Model Prediction ------------------
                         fallback_used = False
-                        if cluster is not None:
-                            try:
-                                model_bundle = joblib.load(f"cluster_models/cluster_{cluster}_bundle.pkl")
-                                model, scaler, score_min, score_max = model_bundle
-                                X_ordered = np.array([[feature_vector[k] for k in feature_engineering.FEATURE_KEYS]])
-                                X_scaled = scaler.transform(X_ordered)
-
-                                score = model.decision_function(X_scaled)[0]
-
-                                # Normalize using actual training score range
-                                if score_max != score_min:
-                                    prob = (score - score_min) / (score_max - score_min)
-                                else:
-                                    prob = 0.5  # fallback if all training scores were same
-
-                            except FileNotFoundError:
-                                if fallback_model and fallback_scaler:
-                                    fallback_used = True
-                                    cluster = "Fallback"
-
-                                    fallback_vector = np.array([[feature_vector[k] for k in feature_engineering.FEATURE_KEYS]])
-
-                                    X_scaled = fallback_scaler.transform(fallback_vector)
-                                    pred = fallback_model.predict(X_scaled)[0]
-                                    prob = 1.0 if pred == 1 else 0.0
-                                else:
-                                    print("⚠️ No model or fallback available.")
-                                    pred = None
-                                    prob = None
+                        if cluster is not None and cluster in cluster_bundles:
+                            X_ordered = np.array([[feature_vector[k] for k in feature_engineering.FEATURE_KEYS]])
+                            prob = score_cluster(cluster, X_ordered)
 
                         elif fallback_model and fallback_scaler:
+                            # Users mapped to a cluster without a trained model reuse the merchant code
+                            # as Payment_Method; unmapped users send their actual payment method
+                            if cluster is not None:
+                                payment_code = merchant_code
+                            else:
+                                payment_code = feature_engineering.PAYMENT_METHOD_MAP.get(tx.get("Payment_Method", "Credit Card"), 0)
                             fallback_used = True
                             cluster = "Fallback"
 
-                            fallback_vector = np.array([[feature_vector[k] for k in feature_engineering.FEATURE_KEYS]])
-                            X_scaled = fallback_scaler.transform(fallback_vector)
-                            pred = fallback_model.predict(X_scaled)[0]
+                            fallback_vector = np.array([feature_engineering.build_fallback_vector(feature_vector, payment_code)])
+                            pred = predict_fallback(fallback_vector)
                             prob = 1.0 if pred == 1 else 0.0
 
                         else:
@@ -21,6 +21,7 @@ MERCHANT_MAP = {
     'Apparel Deals': 16
 }
 DEVICE_MAP = {'Mobile': 0, 'PC': 1, 'Tablet': 2}
+PAYMENT_METHOD_MAP = {'Credit Card': 0, 'Debit Card': 1, 'UPI': 2, 'Net Banking': 3, 'Wallet': 4}
 
 FEATURE_KEYS = [
     'Amount',
@@ -35,32 +36,54 @@ FEATURE_KEYS = [
     'Device_Type_Code'
 ]
 
+def build_fallback_vector(feature_vector, payment_method_code):
+    """The 9 features the fallback XGBoost model was trained on, in training order"""
+    return [
+        feature_vector["Amount"],
+        feature_vector["Active_Loan_Count"],
+        feature_vector["Session_Time"],
+        feature_vector["Transactions_Per_Day"],        # → Transactions_Per_Unit_Time
+        feature_vector["Velocity"],
+        feature_vector["Large_Transaction_Flag"],      # → High_Value_Transaction
+        feature_vector["Large_Transaction_Frequency"], # → Large_Transaction_Freq
+        payment_method_code,                           # → Payment_Method
+        feature_vector["Device_Type_Code"]             # → Device_Type
+    ]
+
 def extract_transaction_features(user_data):
-    features = []
+    if len(user_data) == 0:
+        return pd.DataFrame()
     amounts = user_data['Amount'].astype(float)
     user_avg = amounts.mean()
     user_data = user_data.copy()
     if 'Date' in user_data.columns:
         user_data['Date'] = pd.to_datetime(user_data['Date'])
         user_data = user_data.sort_values('Date')
-    for idx, row in user_data.iterrows():
-        tx_features = {}
-        tx_features['Amount'] = float(row['Amount'])
-        tx_features['Amount_Deviation'] = abs(float(row['Amount']) - user_avg)
-        tx_features['Amount_Ratio'] = float(row['Amount']) / max(user_avg, 1.0)
-        tx_features['Session_Time'] = float(row.get('Session_Time', 0))
-        tx_features['Active_Loan_Count'] = float(row.get('Active_Loan_Count', 0))
-        merchant_code = MERCHANT_MAP.get(row.get('Merchant_Category', ''), 0)
-        device_code = DEVICE_MAP.get(row.get('Device_Type', ''), 0)
-        tx_features['Merchant_Type_Code'] = float(merchant_code)
-        tx_features['Device_Type_Code'] = float(device_code)
-        if 'Date' in user_data.columns:
-            tx_features['Hour_Of_Day'] = float(row['Date'].hour)
-            tx_features['Day_Of_Week'] = float(row['Date'].weekday())
-        else:
-            tx_features['Hour_Of_Day'] = 12.0
-            tx_features['Day_Of_Week'] = 1.0
-        features.append(tx_features)
+    amount = user_data['Amount'].astype(float).to_numpy()
+    n_rows = len(amount)
+    def column(name, default):
+        if name in user_data.columns:
+            return user_data[name].astype(float).to_numpy()
+        return np.full(n_rows, float(default))
+    def codes(name, mapping):
+        if name in user_data.columns:
+            return user_data[name].map(mapping).fillna(0).astype(float).to_numpy()
+        return np.full(n_rows, float(mapping.get('', 0)))
+    features = {
+        'Amount': amount,
+        'Amount_Deviation': np.abs(amount - user_avg),
+        'Amount_Ratio': amount / max(user_avg, 1.0),
+        'Session_Time': column('Session_Time', 0),
+        'Active_Loan_Count': column('Active_Loan_Count', 0),
+        'Merchant_Type_Code': codes('Merchant_Category', MERCHANT_MAP),
+        'Device_Type_Code': codes('Device_Type', DEVICE_MAP)
+    }
+    if 'Date' in user_data.columns:
+        features['Hour_Of_Day'] = user_data['Date'].dt.hour.astype(float).to_numpy()
+        features['Day_Of_Week'] = user_data['Date'].dt.weekday.astype(float).to_numpy()
+    else:
+        features['Hour_Of_Day'] = np.full(n_rows, 12.0)
+        features['Day_Of_Week'] = np.full(n_rows, 1.0)
     return pd.DataFrame(features)
 
 def add_derived_features(centroid, all_data, normal_data, original_user_data):
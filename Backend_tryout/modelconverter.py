@@ -1,7 +1,12 @@
 # modelconverter.py
 import os
+import json
+import time
+import hashlib
+import argparse
 import joblib
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from onnxmltools.convert import convert_xgboost
 from onnxmltools.convert.common.data_types import FloatTensorType
 from skl2onnx import convert_sklearn
@@ -10,12 +15,45 @@ import feature_engineering
 
 model_dir = "cluster_models"
 onnx_dir = "onnx_models"
-os.makedirs(onnx_dir, exist_ok=True)
 features = feature_engineering.FEATURE_KEYS
 n_features = len(features)
 
-def export_xgboost_model(model_path, output_name):
+MANIFEST_NAME = "manifest.json"
+FALLBACK_SOURCE = "fallback_xgboost_model.joblib"
+FALLBACK_ONNX = "fallback_model.onnx"
+
+# ========== Helpers ==========
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def write_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def load_manifest(onnx_dir):
+    try:
+        with open(os.path.join(onnx_dir, MANIFEST_NAME), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_manifest(onnx_dir, manifest):
+    write_atomic(os.path.join(onnx_dir, MANIFEST_NAME), json.dumps(manifest, indent=2).encode())
+
+def onnx_session(onnx_model):
+    import onnxruntime as ort
+    return ort.InferenceSession(onnx_model.SerializeToString(), providers=["CPUExecutionProvider"])
+
+# ========== Export ==========
+def export_xgboost_model(model_path, output_path, check=True):
     from xgboost import Booster, XGBClassifier
+    from onnx_inferencer import probe_rows
 
     model = joblib.load(model_path)
 
@@ -26,37 +64,128 @@ def export_xgboost_model(model_path, output_name):
     else:
         raise ValueError("Unsupported fallback model format")
 
-    initial_type = [('input', FloatTensorType([None, n_features]))]
+    # The fallback model is trained on its own feature set, not FEATURE_KEYS
+    initial_type = [('input', FloatTensorType([None, booster.num_features()]))]
     onnx_model = convert_xgboost(booster, initial_types=initial_type)
-    with open(os.path.join(onnx_dir, output_name), "wb") as f:
-        f.write(onnx_model.SerializeToString())
 
-def export_sklearn_model(model_bundle_path, output_name):
+    parity = None
+    if check and isinstance(model, XGBClassifier):
+        X = probe_rows(booster.num_features(), low=-3.0, high=3.0).astype(np.float32)
+        session = onnx_session(onnx_model)
+        labels = session.run(None, {"input": X})[0].ravel()
+        parity = {"mismatched_labels": int(np.sum(labels != model.predict(X.astype(np.float64))))}
+        if parity["mismatched_labels"]:
+            raise ValueError(f"ONNX labels differ from XGBoost on {parity['mismatched_labels']} probe rows")
+
+    write_atomic(output_path, onnx_model.SerializeToString())
+    return parity
+
+def export_sklearn_model(model_bundle_path, output_path, check=True, atol=1e-5):
+    from onnx_inferencer import probe_rows
+
     model_bundle = joblib.load(model_bundle_path)
     model, scaler, *_ = model_bundle
     initial_type = [('input', SKLFloatTensorType([None, n_features]))]
 
-    # 🔥 Force ai.onnx.ml opset version to v3 using domain_opset
+    # 🔥 Force ai.onnx.ml opset version to v3 (outputs: "label", "scores" = decision_function)
     onnx_model = convert_sklearn(
         model,
         initial_types=initial_type,
-        target_opset=13,
-        options={"zipmap": False},
-        domain_opset={'ai.onnx.ml': 3}
+        target_opset={'': 13, 'ai.onnx.ml': 3}
     )
 
-    with open(os.path.join(onnx_dir, output_name), "wb") as f:
-        f.write(onnx_model.SerializeToString())
+    parity = None
+    if check:
+        X = probe_rows(model.n_features_in_)
+        session = onnx_session(onnx_model)
+        scores = session.run(["scores"], {"input": X.astype(np.float32)})[0].ravel()
+        parity = {"max_abs_diff": float(np.max(np.abs(scores - model.decision_function(X))))}
+        if parity["max_abs_diff"] > atol:
+            raise ValueError(f"ONNX scores differ from sklearn by {parity['max_abs_diff']:.2e}")
+
+    write_atomic(output_path, onnx_model.SerializeToString())
+    return parity
+
+def export_job(kind, source_path, output_path, check, atol):
+    """Runs in a worker process; returns (seconds, parity)"""
+    started = time.perf_counter()
+    if kind == "fallback":
+        parity = export_xgboost_model(source_path, output_path, check)
+    else:
+        parity = export_sklearn_model(source_path, output_path, check, atol)
+    return time.perf_counter() - started, parity
+
+# ========== CLI ==========
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export cluster and fallback models to ONNX")
+    parser.add_argument("--model-dir", default=model_dir, help="Directory with cluster_*_bundle.pkl files")
+    parser.add_argument("--onnx-dir", default=onnx_dir, help="Directory the .onnx files and manifest go to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Export processes")
+    parser.add_argument("--force", action="store_true", help="Re-export models whose source is unchanged")
+    parser.add_argument("--skip-parity", action="store_true", help="Do not compare ONNX output with the source model")
+    parser.add_argument("--atol", type=float, default=1e-5, help="Max allowed |ONNX - sklearn| score difference")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    os.makedirs(args.onnx_dir, exist_ok=True)
+    previous = load_manifest(args.onnx_dir)
+
+    # Every model the directory currently holds: key → (kind, source file, onnx file)
+    sources = {}
+    for f in sorted(os.listdir(args.model_dir)):
+        if f.startswith("cluster_") and f.endswith("_bundle.pkl"):
+            cluster_id = f.split("_")[1]
+            sources[f"cluster_{cluster_id}"] = ("cluster", f, f"cluster_{cluster_id}.onnx")
+    if os.path.exists(os.path.join(args.model_dir, FALLBACK_SOURCE)):
+        sources["fallback"] = ("fallback", FALLBACK_SOURCE, FALLBACK_ONNX)
+
+    entries = {}
+    jobs = {}
+    for key, (kind, source, onnx_file) in sources.items():
+        source_hash = file_hash(os.path.join(args.model_dir, source))
+        old = previous.get("models", {}).get(key)
+        if (not args.force and old and old.get("hash") == source_hash
+                and os.path.exists(os.path.join(args.onnx_dir, onnx_file))):
+            entries[key] = old
+            continue
+        entries[key] = {"kind": kind, "source": source, "onnx": onnx_file, "hash": source_hash}
+        jobs[key] = (kind, os.path.join(args.model_dir, source), os.path.join(args.onnx_dir, onnx_file))
+
+    print(f"🔁 Exporting {len(jobs)} of {len(sources)} models ({len(sources) - len(jobs)} unchanged) "
+          f"with {args.workers} workers")
+    started = time.perf_counter()
+    failures = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(jobs) or 1))) as pool:
+        futures = {pool.submit(export_job, *job, not args.skip_parity, args.atol): key for key, job in jobs.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                seconds, parity = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"❌ Failed to convert {key}: {e}")
+                # Keep whatever export was valid before, or leave the model out entirely
+                if key in previous.get("models", {}):
+                    entries[key] = previous["models"][key]
+                else:
+                    del entries[key]
+                continue
+            entries[key]["parity"] = parity
+            print(f"✅ {key} → {entries[key]['onnx']} in {seconds:.2f}s"
+                  + (f" (parity {parity})" if parity else ""))
 
+    # Drop exports whose source bundle no longer exists
+    for key, old in previous.get("models", {}).items():
+        if key not in sources:
+            stale_path = os.path.join(args.onnx_dir, old["onnx"])
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+            print(f"🗑️ Removed stale export {old['onnx']}")
 
-# Export fallback model (XGBoost)
-export_xgboost_model("cluster_models/fallback_xgboost_model.joblib", "fallback_model.onnx")
+    save_manifest(args.onnx_dir, {"created_at": time.strftime("%Y-%m-%d %H:%M:%S"), "models": entries})
+    print(f"📦 Manifest written with {len(entries)} models in {time.perf_counter() - started:.2f}s")
+    return 1 if failures else 0
 
-# Export all sklearn-based cluster models
-for f in os.listdir(model_dir):
-    if f.startswith("cluster_") and f.endswith("_bundle.pkl"):
-        cluster_id = f.split("_")[1]
-        try:
-            export_sklearn_model(os.path.join(model_dir, f), f"cluster_{cluster_id}.onnx")
-        except Exception as e:
-            print(f"⚠️ Failed to convert cluster_{cluster_id}: {e}")
+if __name__ == "__main__":
+    raise SystemExit(main())
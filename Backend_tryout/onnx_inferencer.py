@@ -1,27 +1,233 @@
 # onnx_inferencer.py
 import os
 import numpy as np
+from collections import OrderedDict
 import onnxruntime as ort
 
+# Best first; only those present in this onnxruntime build are used
+PREFERRED_PROVIDERS = ["CUDAExecutionProvider", "DmlExecutionProvider", "CPUExecutionProvider"]
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+}
+
+ONNX_TO_NUMPY = {
+    "tensor(float)": np.float32,
+    "tensor(double)": np.float64,
+    "tensor(int64)": np.int64,
+    "tensor(int32)": np.int32
+}
+
+def select_providers(preferred=None):
+    """Keep the preferred providers this host's onnxruntime actually has, in order"""
+    available = ort.get_available_providers()
+    providers = [p for p in (preferred or PREFERRED_PROVIDERS) if p in available]
+    return providers or ["CPUExecutionProvider"]
+
+class BoundSession:
+    """
+    An InferenceSession plus reusable input/output buffers for IO binding.
+
+    Buffers grow to the largest batch seen, so steady-state calls only copy the
+    batch into the input buffer and read results out of the output buffer.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.input = session.get_inputs()[0]
+        self.outputs = {o.name: o for o in session.get_outputs()}
+        self.binding = session.io_binding()
+        self.capacity = 0
+        self.input_buffer = None
+        self.output_buffers = {}
+
+    def _reserve(self, n_rows, n_features):
+        if n_rows <= self.capacity and self.input_buffer.shape[1] == n_features:
+            return
+        self.capacity = max(n_rows, 2 * self.capacity, 1)
+        self.input_buffer = np.empty((self.capacity, n_features), dtype=np.float32)
+        self.output_buffers = {}
+        for name, output in self.outputs.items():
+            trailing = [d if isinstance(d, int) else 1 for d in output.shape[1:]]
+            dtype = ONNX_TO_NUMPY.get(output.type, np.float32)
+            self.output_buffers[name] = np.empty([self.capacity] + trailing, dtype=dtype)
+
+    def run(self, input_array, output_name):
+        input_array = np.atleast_2d(input_array)
+        n_rows, n_features = input_array.shape
+        self._reserve(n_rows, n_features)
+        self.input_buffer[:n_rows] = input_array  # casts to float32 in place
+
+        out = self.output_buffers[output_name]
+        self.binding.clear_binding_inputs()
+        self.binding.clear_binding_outputs()
+        self.binding.bind_input(self.input.name, "cpu", 0, np.float32,
+                                [n_rows, n_features], self.input_buffer.ctypes.data)
+        self.binding.bind_output(output_name, "cpu", 0, out.dtype,
+                                 [n_rows] + list(out.shape[1:]), out.ctypes.data)
+        self.session.run_with_iobinding(self.binding)
+        return out[:n_rows].copy()
+
 class ONNXModelManager:
-    def __init__(self, model_dir="onnx_models"):
-        self.models = {}
+    """
+    Serves the .onnx models in model_dir, creating each InferenceSession on
+    first use and keeping at most max_sessions of them (and, if set, about
+    max_memory_mb of model data) in an LRU; the least recently used session
+    is dropped first and simply recreated if it is needed again.
+
+    A process holds one session per cluster, so each session gets a small
+    thread pool (intra_op_threads=1 by default) instead of onnxruntime's
+    default of one thread per core per session, which oversubscribes the CPU
+    once a dozen sessions are resident.
+    """
+
+    def __init__(self, model_dir="onnx_models", providers=None, intra_op_threads=1, inter_op_threads=1,
+                 graph_optimization="all", enable_cpu_mem_arena=True, enable_mem_pattern=True,
+                 max_sessions=64, max_memory_mb=None):
+        self.models = OrderedDict()  # name → session, least recently used first
+        self.bound = {}
+        self.paths = {}
+        self.sizes = {}
         self.model_dir = model_dir
+        self.providers = select_providers(providers)
+        self.max_sessions = max_sessions
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024 if max_memory_mb else None
+        self.memory_bytes = 0
+        self.loads = 0
+        self.evictions = 0
+
         self.session_options = ort.SessionOptions()
-        self.providers = ["DmlExecutionProvider", "CPUExecutionProvider"]
+        self.session_options.intra_op_num_threads = intra_op_threads
+        self.session_options.inter_op_num_threads = inter_op_threads
+        self.session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        self.session_options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[graph_optimization]
+        self.session_options.enable_cpu_mem_arena = enable_cpu_mem_arena
+        self.session_options.enable_mem_pattern = enable_mem_pattern
 
         for file in os.listdir(model_dir):
             if file.endswith(".onnx"):
                 name = file.replace(".onnx", "")
-                path = os.path.join(model_dir, file)
-                self.models[name] = ort.InferenceSession(path, sess_options=self.session_options, providers=self.providers)
+                self.paths[name] = os.path.join(model_dir, file)
+
+    def has_model(self, model_name):
+        return model_name in self.paths
 
-    def predict(self, model_name, input_array):
+    def _session(self, model_name):
         session = self.models.get(model_name)
-        if not session:
+        if session is not None:
+            self.models.move_to_end(model_name)
+            return session
+
+        path = self.paths.get(model_name)
+        if not path:
             raise ValueError(f"Model {model_name} not found")
+        session = ort.InferenceSession(path, sess_options=self.session_options, providers=self.providers)
+        # The serialized model size stands in for the session's memory footprint
+        size = os.path.getsize(path)
+        self.models[model_name] = session
+        self.sizes[model_name] = size
+        self.memory_bytes += size
+        self.loads += 1
+        self._evict(keep=model_name)
+        return session
+
+    def _evict(self, keep):
+        while len(self.models) > 1 and (
+                (self.max_sessions and len(self.models) > self.max_sessions) or
+                (self.max_memory_bytes and self.memory_bytes > self.max_memory_bytes)):
+            name = next(iter(self.models))
+            if name == keep:
+                break
+            del self.models[name]
+            self.bound.pop(name, None)
+            self.memory_bytes -= self.sizes.pop(name)
+            self.evictions += 1
+
+    def warm_up(self, model_names):
+        """Create sessions ahead of traffic and run one row through each"""
+        for name in model_names:
+            if not self.has_model(name):
+                continue
+            session = self._session(name)
+            shape = session.get_inputs()[0].shape
+            n_features = shape[1] if isinstance(shape[1], int) else 1
+            self.predict_many(name, np.zeros((1, n_features), dtype=np.float32))
+
+    def stats(self):
+        return {
+            "available": len(self.paths),
+            "resident": len(self.models),
+            "memory_mb": round(self.memory_bytes / (1024 * 1024), 2),
+            "loads": self.loads,
+            "evictions": self.evictions
+        }
 
+    def predict(self, model_name, input_array, output_name=None):
+        """Run a model and return one output: the first by default, or output_name (e.g. "scores")"""
+        session = self._session(model_name)
         input_name = session.get_inputs()[0].name
-        output = session.run(None, {input_name: input_array.astype(np.float32)})
-        return output[0]
+        if output_name is None:
+            output = session.run(None, {input_name: input_array.astype(np.float32)})
+            return output[0]
+        return session.run([output_name], {input_name: input_array.astype(np.float32)})[0]
+
+    def predict_many(self, model_name, input_array, output_name=None):
+        """Like predict(), but runs through IO binding with buffers reused across calls"""
+        session = self._session(model_name)
+        bound = self.bound.get(model_name)
+        if bound is None:
+            bound = self.bound[model_name] = BoundSession(session)
+        if output_name is None:
+            output_name = bound.session.get_outputs()[0].name
+        return bound.run(input_array, output_name)
+
+# ========== Scaling in NumPy ==========
+class NumpyScaler:
+    """MinMaxScaler / StandardScaler transform without sklearn's per-call input validation"""
+
+    def __init__(self, scaler):
+        if hasattr(scaler, "data_min_"):  # MinMaxScaler: X * scale_ + min_
+            self.mean = None
+            self.divisor = None
+            self.scale = scaler.scale_
+            self.offset = scaler.min_
+        else:  # StandardScaler: (X - mean_) / scale_
+            self.mean = scaler.mean_
+            self.divisor = scaler.scale_
+            self.scale = None
+            self.offset = None
+
+    def transform(self, X):
+        X = np.array(X, dtype=np.float64, ndmin=2)
+        if self.mean is not None:
+            X -= self.mean
+        if self.divisor is not None:
+            X /= self.divisor
+        if self.scale is not None:
+            X *= self.scale
+            X += self.offset
+        return X
+
+# ========== Parity Checks ==========
+def probe_rows(n_features, n_rows=512, seed=0, low=-0.25, high=1.25):
+    """Rows spread over (and a little beyond) the scaled training range"""
+    return np.random.default_rng(seed).uniform(low, high, size=(n_rows, n_features))
+
+def check_isolation_forest_parity(manager, model_name, model, atol=1e-5):
+    """Compare ONNX "scores" with sklearn decision_function; returns (ok, max_abs_diff)"""
+    X = probe_rows(model.n_features_in_)
+    onnx_scores = manager.predict_many(model_name, X, output_name="scores").ravel()
+    diff = float(np.max(np.abs(onnx_scores - model.decision_function(X))))
+    return diff <= atol, diff
 
+def check_classifier_parity(manager, model_name, model, n_features):
+    """Compare ONNX labels with the sklearn-API classifier; returns (ok, mismatched_rows)"""
+    X = probe_rows(n_features, low=-3.0, high=3.0)
+    # ONNX sees float32 inputs, so give the reference model the same values
+    X = X.astype(np.float32).astype(np.float64)
+    onnx_labels = manager.predict_many(model_name, X).ravel()
+    mismatches = int(np.sum(onnx_labels != np.asarray(model.predict(X)).ravel()))
+    return mismatches == 0, mismatches